@@ -23,6 +23,12 @@ class Settings(BaseSettings):
     # Encryption
     encryption_key: str | None = None
     
+    # Agent logging - store full request structures (system prompt + history) in stage logs
+    log_full_prompts: bool = False
+    
+    # Image generation - follow ComfyUI progress over WebSocket instead of polling /history
+    comfyui_ws_progress: bool = False
+    
     class Config:
         env_prefix = "DEEPRP_"
         env_file = ".env"
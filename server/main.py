@@ -9,7 +9,9 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 
 from config import settings
-from models import init_db
+from models import init_db, init_db_pool, close_db_pool
+from utils import close_http_client
+from services.session_store import compact_session_logs
 
 
 @asynccontextmanager
@@ -17,10 +19,14 @@ async def lifespan(app: FastAPI):
     """Application lifespan events."""
     # Startup
     await init_db()
+    await init_db_pool()
     print(f"DeepRP started on http://localhost:{settings.port}")
     yield
     # Shutdown
     print("DeepRP shutting down...")
+    await compact_session_logs()
+    await close_db_pool()
+    await close_http_client()
 
 
 # Create FastAPI app
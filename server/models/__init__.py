@@ -19,6 +19,7 @@ from .database import (
     AgentStageLog,
     mask_api_key,
 )
+from .db_pool import acquire as acquire_db, init_pool as init_db_pool, close_pool as close_db_pool
 
 __all__ = [
     "init_db",
@@ -37,4 +38,7 @@ __all__ = [
     "AgentRun",
     "AgentStageLog",
     "mask_api_key",
+    "acquire_db",
+    "init_db_pool",
+    "close_db_pool",
 ]
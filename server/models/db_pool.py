@@ -0,0 +1,92 @@
+"""
+Small pool of long-lived SQLite connections for hot read paths
+(image/LLM/TTS config lookups, regex scripts).
+
+Connections are opened lazily (or prefilled at startup) with PRAGMAs applied
+once, then handed out through an asyncio.Queue instead of reconnecting per call.
+Reusing a connection also keeps SQLite's per-connection statement cache warm.
+"""
+import asyncio
+import aiosqlite
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from .database import DATABASE_PATH
+
+
+POOL_SIZE = 4
+
+# WAL lets config reads proceed alongside writers; the rest trims per-query overhead
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",  # 20MB per connection is plenty for the small config tables
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_idle: Optional[asyncio.Queue] = None
+_opened = 0
+
+
+def _get_idle() -> asyncio.Queue:
+    global _idle
+    if _idle is None:
+        _idle = asyncio.Queue()
+    return _idle
+
+
+async def _connect() -> aiosqlite.Connection:
+    """Open a connection with row access by name and PRAGMAs applied."""
+    db = await aiosqlite.connect(DATABASE_PATH)
+    db.row_factory = aiosqlite.Row
+    for pragma in _SQLITE_PRAGMAS:
+        await db.execute(pragma)
+    return db
+
+
+@asynccontextmanager
+async def acquire() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a pooled connection, opening a new one while below POOL_SIZE."""
+    global _opened
+    idle = _get_idle()
+    if idle.empty() and _opened < POOL_SIZE:
+        _opened += 1
+        try:
+            db = await _connect()
+        except Exception:
+            _opened -= 1
+            raise
+    else:
+        db = await idle.get()
+
+    try:
+        yield db
+    finally:
+        # Never hand the next borrower a connection with a half-finished transaction
+        if db.in_transaction:
+            await db.rollback()
+        idle.put_nowait(db)
+
+
+async def init_pool():
+    """Prefill the pool so the first request doesn't pay for connecting."""
+    global _opened
+    idle = _get_idle()
+    while _opened < POOL_SIZE:
+        _opened += 1
+        try:
+            idle.put_nowait(await _connect())
+        except Exception:
+            _opened -= 1
+            raise
+
+
+async def close_pool():
+    """Close all idle pooled connections."""
+    global _opened
+    idle = _get_idle()
+    while not idle.empty():
+        db = idle.get_nowait()
+        _opened -= 1
+        await db.close()
@@ -10,8 +10,12 @@ import json
 import asyncio
 
 from config import settings
-from utils import save_json, load_json, list_json_files, generate_id
+from utils import load_json, list_json_files, generate_id
 from services.llm.stream_handler import stream_completion, get_llm_config
+from services.session_store import (
+    merge_session_logs, load_session_data, save_session_data,
+    append_session_messages, delete_session_files,
+)
 from services.regex import process_for_display, process_for_prompt
 
 router = APIRouter()
@@ -586,14 +590,10 @@ class SendMessageRequest(BaseModel):
     session_id: str = Field(..., max_length=100)
 
 
-def get_session_path(session_id: str):
-    return settings.data_dir / "chats" / f"{session_id}.json"
-
-
 @router.get("/sessions", response_model=list[ChatSession])
 async def list_sessions():
     """List all chat sessions with backwards compatibility."""
-    sessions = await list_json_files(settings.data_dir / "chats")
+    sessions = await merge_session_logs(await list_json_files(settings.data_dir / "chats"))
     result = []
     for s in sessions:
         # Migrate old worldbook_id to worldbook_ids if needed
@@ -608,7 +608,7 @@ async def list_sessions():
 @router.get("/sessions/{session_id}", response_model=ChatSession)
 async def get_session(session_id: str):
     """Get a specific chat session with backwards compatibility."""
-    data = await load_json(get_session_path(session_id))
+    data = await load_session_data(session_id)
     if not data:
         raise HTTPException(status_code=404, detail="Session not found")
     # Migrate old worldbook_id to worldbook_ids if needed
@@ -659,17 +659,15 @@ async def create_session(request: ChatSessionCreate):
         updated_at=now,
     )
     
-    await save_json(get_session_path(session_id), session.model_dump())
+    await save_session_data(session_id, session.model_dump())
     return session
 
 
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     """Delete a chat session."""
-    path = get_session_path(session_id)
-    if not path.exists():
+    if not await delete_session_files(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
-    path.unlink()
     return {"status": "deleted"}
 
 
@@ -677,7 +675,7 @@ async def delete_session(session_id: str):
 async def send_message(session_id: str, request: SendMessageRequest):
     """Send a message and get streaming response."""
     # Load session
-    session_data = await load_json(get_session_path(session_id))
+    session_data = await load_session_data(session_id)
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -693,8 +691,8 @@ async def send_message(session_id: str, request: SendMessageRequest):
     session.messages.append(user_msg)
     
     # Save with user message
-    session.updated_at = datetime.utcnow().isoformat()
-    await save_json(get_session_path(session_id), session.model_dump())
+    session.updated_at = user_msg.timestamp
+    await append_session_messages(session_id, [user_msg.model_dump()])
     
     # Get LLM config
     llm_config = await get_llm_config()
@@ -794,8 +792,8 @@ async def send_message(session_id: str, request: SendMessageRequest):
                 timestamp=datetime.utcnow().isoformat(),
             )
             session.messages.append(assistant_msg)
-            session.updated_at = datetime.utcnow().isoformat()
-            await save_json(get_session_path(session_id), session.model_dump())
+            session.updated_at = assistant_msg.timestamp
+            await append_session_messages(session_id, [assistant_msg.model_dump()])
             
             # Send the processed content in done event for frontend to update
             yield f"data: {json.dumps({'done': True, 'message_id': assistant_msg_id, 'processed_content': processed_response})}\n\n"
@@ -817,7 +815,7 @@ async def send_message(session_id: str, request: SendMessageRequest):
 @router.post("/sessions/{session_id}/regenerate/{message_id}")
 async def regenerate_message(session_id: str, message_id: str):
     """Regenerate a specific assistant message."""
-    session_data = await load_json(get_session_path(session_id))
+    session_data = await load_session_data(session_id)
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -915,7 +913,7 @@ async def regenerate_message(session_id: str, message_id: str):
             )
             session.messages.append(assistant_msg)
             session.updated_at = datetime.utcnow().isoformat()
-            await save_json(get_session_path(session_id), session.model_dump())
+            await save_session_data(session_id, session.model_dump())
             
             yield f"data: {json.dumps({'done': True, 'message_id': new_msg_id, 'processed_content': processed_response})}\n\n"
         except Exception as e:
@@ -941,6 +939,7 @@ async def get_latest_session_for_character(character_id: str):
         if s.get("character_id") == character_id
     ]
     
+    character_sessions = await merge_session_logs(character_sessions)
     if not character_sessions:
         return None
     
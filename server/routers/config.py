@@ -13,7 +13,8 @@ from models import (
     LLMConfigUpdate,
     mask_api_key,
 )
-from utils import encrypt_api_key, decrypt_api_key, generate_id
+from utils import encrypt_api_key_async, decrypt_api_key_async, decrypt_api_keys_async, generate_id
+from services.llm import invalidate_llm_config_cache
 
 router = APIRouter()
 
@@ -25,18 +26,20 @@ async def list_llm_configs():
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM llm_configs ORDER BY name") as cursor:
             rows = await cursor.fetchall()
+            # Decrypt every row's key in one worker-thread hop, off the event loop
+            api_keys = await decrypt_api_keys_async([row["api_key_encrypted"] for row in rows])
             return [
                 LLMConfig(
                     id=row["id"],
                     name=row["name"],
                     base_url=row["base_url"],
-                    api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                    api_key_masked=mask_api_key(api_key),
                     default_model=row["default_model"],
                     is_active=bool(row["is_active"]),
                     created_at=row["created_at"],
                     updated_at=row["updated_at"],
                 )
-                for row in rows
+                for row, api_key in zip(rows, api_keys)
             ]
 
 
@@ -45,7 +48,7 @@ async def create_llm_config(config: LLMConfigCreate):
     """Create a new LLM configuration."""
     config_id = generate_id()
     now = datetime.utcnow().isoformat()
-    encrypted_key = encrypt_api_key(config.api_key)
+    encrypted_key = await encrypt_api_key_async(config.api_key)
     
     async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
@@ -93,7 +96,7 @@ async def update_llm_config(config_id: str, update: LLMConfigUpdate):
             values.append(update.base_url)
         if update.api_key is not None:
             updates.append("api_key_encrypted = ?")
-            values.append(encrypt_api_key(update.api_key))
+            values.append(await encrypt_api_key_async(update.api_key))
         if update.default_model is not None:
             updates.append("default_model = ?")
             values.append(update.default_model)
@@ -114,6 +117,7 @@ async def update_llm_config(config_id: str, update: LLMConfigUpdate):
             values
         )
         await db.commit()
+        invalidate_llm_config_cache()
         
         # Return updated config
         async with db.execute("SELECT * FROM llm_configs WHERE id = ?", (config_id,)) as cursor:
@@ -122,7 +126,7 @@ async def update_llm_config(config_id: str, update: LLMConfigUpdate):
                 id=row["id"],
                 name=row["name"],
                 base_url=row["base_url"],
-                api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                api_key_masked=mask_api_key(await decrypt_api_key_async(row["api_key_encrypted"])),
                 default_model=row["default_model"],
                 is_active=bool(row["is_active"]),
                 created_at=row["created_at"],
@@ -136,6 +140,7 @@ async def delete_llm_config(config_id: str):
     async with aiosqlite.connect(DATABASE_PATH) as db:
         result = await db.execute("DELETE FROM llm_configs WHERE id = ?", (config_id,))
         await db.commit()
+        invalidate_llm_config_cache()
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Config not found")
     return {"status": "deleted"}
@@ -151,7 +156,7 @@ async def fetch_models(config_id: str):
             if not row:
                 raise HTTPException(status_code=404, detail="Config not found")
     
-    api_key = decrypt_api_key(row["api_key_encrypted"])
+    api_key = await decrypt_api_key_async(row["api_key_encrypted"])
     base_url = row["base_url"].rstrip("/")
     
     try:
@@ -232,7 +237,7 @@ async def get_active_config():
                 id=row["id"],
                 name=row["name"],
                 base_url=row["base_url"],
-                api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                api_key_masked=mask_api_key(await decrypt_api_key_async(row["api_key_encrypted"])),
                 default_model=row["default_model"],
                 is_active=True,
                 created_at=row["created_at"],
@@ -8,8 +8,8 @@ from pydantic import BaseModel
 import aiosqlite
 
 from models import DATABASE_PATH, ImageConfig, ImageConfigCreate, mask_api_key
-from utils import encrypt_api_key, decrypt_api_key, generate_id
-from services.image import generate_image
+from utils import encrypt_api_key_async, decrypt_api_key_async, decrypt_api_keys_async, generate_id
+from services.image import generate_image, invalidate_image_config_cache
 
 router = APIRouter()
 
@@ -21,15 +21,17 @@ async def list_image_configs():
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM image_configs ORDER BY name") as cursor:
             rows = await cursor.fetchall()
+            # Decrypt every row's key in one worker-thread hop, off the event loop
+            api_keys = await decrypt_api_keys_async([row["api_key_encrypted"] for row in rows])
             result = []
-            for row in rows:
+            for row, api_key in zip(rows, api_keys):
                 # Handle missing columns for backwards compatibility
                 result.append(ImageConfig(
                     id=row["id"],
                     name=row["name"],
                     type=row["type"],
                     base_url=row["base_url"],
-                    api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                    api_key_masked=mask_api_key(api_key),
                     model=row["model"],
                     size=row["size"] or "1024x1024",
                     quality=row["quality"] or "standard",
@@ -51,7 +53,7 @@ async def create_image_config(config: ImageConfigCreate):
     """Create a new image generation configuration."""
     config_id = generate_id()
     now = datetime.utcnow().isoformat()
-    encrypted_key = encrypt_api_key(config.api_key)
+    encrypted_key = await encrypt_api_key_async(config.api_key)
     
     async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
@@ -103,7 +105,7 @@ async def update_image_config(config_id: str, config: ImageConfigCreate):
                 raise HTTPException(status_code=404, detail="Config not found")
         
         # Encrypt API key if provided
-        encrypted_key = encrypt_api_key(config.api_key) if config.api_key else ""
+        encrypted_key = await encrypt_api_key_async(config.api_key) if config.api_key else ""
         
         # Update config
         await db.execute("""
@@ -121,6 +123,7 @@ async def update_image_config(config_id: str, config: ImageConfigCreate):
             now, config_id
         ))
         await db.commit()
+        invalidate_image_config_cache()
         
         # Return updated config
         async with db.execute("SELECT * FROM image_configs WHERE id = ?", (config_id,)) as cursor:
@@ -130,7 +133,7 @@ async def update_image_config(config_id: str, config: ImageConfigCreate):
                 name=row["name"],
                 type=row["type"],
                 base_url=row["base_url"],
-                api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                api_key_masked=mask_api_key(await decrypt_api_key_async(row["api_key_encrypted"])),
                 model=row["model"],
                 size=row["size"] or "1024x1024",
                 quality=row["quality"] or "standard",
@@ -152,6 +155,7 @@ async def delete_image_config(config_id: str):
     async with aiosqlite.connect(DATABASE_PATH) as db:
         result = await db.execute("DELETE FROM image_configs WHERE id = ?", (config_id,))
         await db.commit()
+        invalidate_image_config_cache()
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Config not found")
     return {"status": "deleted"}
@@ -167,6 +171,7 @@ async def activate_image_config(config_id: str):
             (datetime.utcnow().isoformat(), config_id)
         )
         await db.commit()
+    invalidate_image_config_cache()
     return {"status": "activated"}
 
 
@@ -204,7 +209,7 @@ async def test_image_config(config_id: str):
     
     api_type = row["type"]
     base_url = row["base_url"].rstrip("/")
-    api_key = decrypt_api_key(row["api_key_encrypted"])
+    api_key = await decrypt_api_key_async(row["api_key_encrypted"])
     
     try:
         async with httpx.AsyncClient() as client:
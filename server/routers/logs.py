@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, Query
 from datetime import datetime
 from typing import Optional
 import aiosqlite
-import json
+import orjson
 
 from models import DATABASE_PATH, RequestLog
 from utils import generate_id
@@ -22,9 +22,15 @@ async def log_request(
     tokens_out: int = 0,
     duration_ms: int = 0,
     status: str = "success",
-    error_message: str = None
+    error_message: str = None,
+    full_request_bytes: Optional[bytes] = None
 ) -> str:
-    """Log an LLM request to the database."""
+    """
+    Log an LLM request to the database.
+    
+    Pass full_request_bytes when the request body was already serialized for sending,
+    so it is stored as-is instead of being encoded a second time.
+    """
     log_id = generate_id()
     now = datetime.utcnow().isoformat()
     
@@ -46,8 +52,8 @@ async def log_request(
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (log_id, now, request_type, model, prompt_preview,
-             json.dumps(full_request, ensure_ascii=False) if full_request else None,
-             json.dumps(full_response, ensure_ascii=False) if full_response else None,
+             _to_json(full_request, full_request_bytes),
+             _to_json(full_response),
              tokens_in, tokens_out, duration_ms, status, error_message)
         )
         await db.commit()
@@ -55,6 +61,12 @@ async def log_request(
     return log_id
 
 
+def _to_json(value, encoded: Optional[bytes] = None) -> Optional[str]:
+    if encoded is not None:
+        return encoded.decode()
+    return orjson.dumps(value).decode() if value else None
+
+
 @router.get("", response_model=list[RequestLog])
 async def list_logs(
     limit: int = Query(50, ge=1, le=500),
@@ -9,8 +9,8 @@ from pydantic import BaseModel
 import aiosqlite
 
 from models import DATABASE_PATH, TTSConfig, TTSConfigCreate, mask_api_key
-from utils import encrypt_api_key, decrypt_api_key, generate_id
-from services.tts import synthesize_speech
+from utils import encrypt_api_key_async, decrypt_api_key_async, decrypt_api_keys_async, generate_id
+from services.tts import synthesize_speech, invalidate_tts_config_cache
 
 router = APIRouter()
 
@@ -22,14 +22,16 @@ async def list_tts_configs():
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM tts_configs ORDER BY name") as cursor:
             rows = await cursor.fetchall()
+            # Decrypt every row's key in one worker-thread hop, off the event loop
+            api_keys = await decrypt_api_keys_async([row["api_key_encrypted"] for row in rows])
             result = []
-            for row in rows:
+            for row, api_key in zip(rows, api_keys):
                 # Handle backwards compatibility for old schemas
                 result.append(TTSConfig(
                     id=row["id"],
                     name=row["name"],
                     type=row["type"],
-                    api_key_masked=mask_api_key(decrypt_api_key(row["api_key_encrypted"])),
+                    api_key_masked=mask_api_key(api_key),
                     default_voice_id=row["default_voice_id"],
                     model_id=row["model_id"] if "model_id" in row.keys() else "",
                     stability=row["stability"] if "stability" in row.keys() else 0.5,
@@ -48,7 +50,7 @@ async def create_tts_config(config: TTSConfigCreate):
     """Create a new TTS configuration."""
     config_id = generate_id()
     now = datetime.utcnow().isoformat()
-    encrypted_key = encrypt_api_key(config.api_key)
+    encrypted_key = await encrypt_api_key_async(config.api_key)
     
     async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
@@ -87,6 +89,7 @@ async def delete_tts_config(config_id: str):
     async with aiosqlite.connect(DATABASE_PATH) as db:
         result = await db.execute("DELETE FROM tts_configs WHERE id = ?", (config_id,))
         await db.commit()
+        invalidate_tts_config_cache()
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Config not found")
     return {"status": "deleted"}
@@ -102,6 +105,7 @@ async def activate_tts_config(config_id: str):
             (datetime.utcnow().isoformat(), config_id)
         )
         await db.commit()
+    invalidate_tts_config_cache()
     return {"status": "activated"}
 
 
@@ -191,7 +195,7 @@ async def get_available_voices(config_id: str):
     try:
         voices = await get_available_voices(
             type=row["type"],
-            api_key=decrypt_api_key(row["api_key_encrypted"])
+            api_key=await decrypt_api_key_async(row["api_key_encrypted"])
         )
         return {"voices": voices}
     except Exception as e:
@@ -211,7 +215,7 @@ async def test_tts_config(config_id: str):
                 raise HTTPException(status_code=404, detail="Config not found")
     
     tts_type = row["type"]
-    api_key = decrypt_api_key(row["api_key_encrypted"])
+    api_key = await decrypt_api_key_async(row["api_key_encrypted"])
     
     try:
         async with httpx.AsyncClient() as client:
@@ -7,17 +7,25 @@ Refactored architecture:
 - Macro expansion handled by build_system_prompt from chat router
 """
 import re
-import json
+import asyncio
+import orjson
 from typing import AsyncIterator, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 
 from models import AgentConfig
-from utils import load_json, save_json, generate_id
+from utils import load_json, generate_id
 from config import settings
 from services.llm import stream_completion, get_completion, get_llm_config
 from services.image import generate_image
 from services.tts import synthesize_speech
 from services.regex import process_for_agent_stage
+from services.session_store import load_session_data, append_session_messages
+
+# Bound on buffered Writer/Paint events; producers wait when the client falls behind
+EVENT_QUEUE_MAXSIZE = 128
+
+# Pushed by each parallel producer when it finishes
+_STREAM_DONE = object()
 
 
 async def get_preset(preset_id: str) -> Optional[dict]:
@@ -38,10 +46,18 @@ async def get_worldbook(worldbook_id: str) -> Optional[dict]:
     return await load_json(path)
 
 
+async def get_llm_config_cached(config_id: str, cache: Optional[dict] = None) -> Optional[dict]:
+    """Get an LLM config, reusing configs already loaded during this pipeline run."""
+    if cache is None:
+        return await get_llm_config(config_id)
+    if config_id not in cache:
+        cache[config_id] = await get_llm_config(config_id)
+    return cache[config_id]
+
+
 async def get_session(session_id: str) -> Optional[dict]:
     """Load a chat session from file."""
-    path = settings.data_dir / "chats" / f"{session_id}.json"
-    return await load_json(path)
+    return await load_session_data(session_id)
 
 
 def extract_dialogues(text: str) -> list[dict]:
@@ -53,23 +69,32 @@ def extract_dialogues(text: str) -> list[dict]:
     for m in re.findall(xml_pattern, text, re.DOTALL):
         dialogues.append({"character": m[0], "emotion": m[1] or "neutral", "text": m[2].strip()})
     
+    # Texts already extracted, used to avoid duplicates across formats
+    seen_texts = {d["text"] for d in dialogues}
+    
     # Japanese quotes: 「text」 after character name (NAME: 「text」 or NAME：「text」)
     jp_pattern = r'([A-Za-z\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff]+)[：:]\s*「([^」]+)」'
     for m in re.findall(jp_pattern, text):
-        if not any(d["text"] == m[1].strip() for d in dialogues):  # Avoid duplicates
-            dialogues.append({"character": m[0], "emotion": "neutral", "text": m[1].strip()})
+        t = m[1].strip()
+        if t not in seen_texts:
+            seen_texts.add(t)
+            dialogues.append({"character": m[0], "emotion": "neutral", "text": t})
     
     # Smart/curly quotes: "text" after character name (NAME: "text")
     smart_pattern = r'([A-Za-z\u4e00-\u9fff]+)[：:]\s*"([^"]+)"'
     for m in re.findall(smart_pattern, text):
-        if not any(d["text"] == m[1].strip() for d in dialogues):
-            dialogues.append({"character": m[0], "emotion": "neutral", "text": m[1].strip()})
+        t = m[1].strip()
+        if t not in seen_texts:
+            seen_texts.add(t)
+            dialogues.append({"character": m[0], "emotion": "neutral", "text": t})
     
     # Standard quotes: "text" after character name (NAME: "text")
     quote_pattern = r'([A-Za-z\u4e00-\u9fff]+)[：:]\s*"([^"]+)"'
     for m in re.findall(quote_pattern, text):
-        if not any(d["text"] == m[1].strip() for d in dialogues):
-            dialogues.append({"character": m[0], "emotion": "neutral", "text": m[1].strip()})
+        t = m[1].strip()
+        if t not in seen_texts:
+            seen_texts.add(t)
+            dialogues.append({"character": m[0], "emotion": "neutral", "text": t})
     
     return dialogues
 
@@ -130,7 +155,8 @@ async def run_director(
     chat_history: list[dict],
     character: Optional[dict],
     worldbook: Optional[dict],
-    config: AgentConfig
+    config: AgentConfig,
+    llm_config_cache: Optional[dict] = None
 ) -> AsyncIterator[tuple[str, Optional[dict]]]:
     """
     Run the Director agent to generate a scene outline (streaming).
@@ -138,7 +164,7 @@ async def run_director(
     Input: Preset (expanded with character, worldbook, context) + User Message
     Output: Yields (chunk, None) during streaming, then (full_outline, request_structure) at end
     """
-    llm_config = await get_llm_config(config.director_llm_config_id)
+    llm_config = await get_llm_config_cached(config.director_llm_config_id, llm_config_cache)
     if not llm_config:
         raise Exception("Director LLM config not found")
     
@@ -160,16 +186,11 @@ Provide a concise scene outline (2-3 paragraphs) that a writer can use to craft
     # User message = interaction content
     # Build messages: system prompt → chat history → user message
     messages = [
-        {"role": "system", "content": system_prompt}
+        {"role": "system", "content": system_prompt},
+        *({"role": msg.get("role", "user"), "content": msg.get("content", "")} for msg in chat_history),
+        {"role": "user", "content": user_message},
     ]
     
-    # Add chat history between system prompt and current user message
-    for msg in chat_history:
-        messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
-    
-    # Add current user message
-    messages.append({"role": "user", "content": user_message})
-    
     params = {}
     if preset:
         params = {
@@ -205,7 +226,8 @@ async def run_writer(
     character: Optional[dict],
     worldbook: Optional[dict],
     config: AgentConfig,
-    request_info: Optional[dict] = None
+    request_info: Optional[dict] = None,
+    llm_config_cache: Optional[dict] = None
 ) -> AsyncIterator[str]:
     """
     Run the Writer agent to generate the narrative.
@@ -215,7 +237,7 @@ async def run_writer(
     
     If request_info dict is provided, it will be populated with the full request structure.
     """
-    llm_config = await get_llm_config(config.writer_llm_config_id)
+    llm_config = await get_llm_config_cached(config.writer_llm_config_id, llm_config_cache)
     if not llm_config:
         raise Exception("Writer LLM config not found")
     
@@ -233,16 +255,11 @@ Be descriptive and immersive. Write dialogue naturally."""
     # User message = Director's outline
     # Build messages: system prompt → chat history → outline
     messages = [
-        {"role": "system", "content": system_prompt}
+        {"role": "system", "content": system_prompt},
+        *({"role": msg.get("role", "user"), "content": msg.get("content", "")} for msg in chat_history),
+        {"role": "user", "content": f"Based on this scene outline, write the narrative:\n\n{outline}"},
     ]
     
-    # Add chat history for context
-    for msg in chat_history:
-        messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
-    
-    # Add director's outline as the current task
-    messages.append({"role": "user", "content": f"Based on this scene outline, write the narrative:\n\n{outline}"})
-    
     params = {}
     if preset:
         params = {
@@ -272,7 +289,8 @@ async def run_paint_director(
     character: Optional[dict],
     worldbook: Optional[dict],
     session_id: str,
-    config: AgentConfig
+    config: AgentConfig,
+    llm_config_cache: Optional[dict] = None
 ) -> AsyncIterator[tuple[Optional[str], Optional[str], bool]]:
     """
     Run the Paint Director agent to generate an image (streaming prompt generation).
@@ -296,7 +314,7 @@ async def run_paint_director(
         yield (None, "ERROR: Image API not configured in Agent Settings", True)
         return
     
-    llm_config = await get_llm_config(config.painter_llm_config_id)
+    llm_config = await get_llm_config_cached(config.painter_llm_config_id, llm_config_cache)
     if not llm_config:
         print(f"Paint Director ERROR: LLM config '{config.painter_llm_config_id}' not found in database")
         yield (None, f"ERROR: Paint Director LLM config not found", True)
@@ -337,18 +355,19 @@ Keep it under 200 words. Output ONLY the prompt, no explanations or preamble."""
         script_ids=preset_regex_ids if preset_regex_ids else None,
         target="prompt"
     )
+    image_prompt = image_prompt.strip()
     
     # Generate image from the complete prompt
     try:
         image_url = await generate_image(
-            prompt=image_prompt.strip(),
+            prompt=image_prompt,
             chat_session_id=session_id,
             config_id=config.image_config_id
         )
-        yield (image_url, image_prompt.strip(), True)
+        yield (image_url, image_prompt, True)
     except Exception as e:
         print(f"Paint error: {e}")
-        yield (None, image_prompt.strip(), True)
+        yield (None, image_prompt, True)
 
 
 async def run_tts_for_dialogues(
@@ -430,6 +449,7 @@ async def run_agent_pipeline(
         return
     
     pipeline_start = time.time()
+    llm_config_cache: dict[str, Optional[dict]] = {}  # Stages often share LLM configs
     
     # Create agent run record
     run_id = await create_agent_run(session_id, user_message, character_id)
@@ -461,7 +481,9 @@ async def run_agent_pipeline(
         # Stream director output to frontend
         outline = ""
         director_request = None
-        async for chunk, req_struct in run_director(user_message, chat_history, character, worldbook, config):
+        async for chunk, req_struct in run_director(
+            user_message, chat_history, character, worldbook, config, llm_config_cache
+        ):
             if req_struct is not None:
                 # Final yield with request structure
                 director_request = req_struct
@@ -470,9 +492,13 @@ async def run_agent_pipeline(
                 outline += chunk
                 yield {"type": "director_chunk", "content": chunk}
         
-        # Log full request structure as JSON
+        # Log full request structure as compact JSON (the log viewer re-formats it)
+        if director_request and settings.log_full_prompts:
+            director_input = (await asyncio.to_thread(orjson.dumps, director_request)).decode()
+        else:
+            director_input = user_message
         stage_id = await start_stage_log(
-            run_id, "director", json.dumps(director_request, ensure_ascii=False, indent=2) if director_request else user_message,
+            run_id, "director", director_input,
             config.director_llm_config_id, config.director_preset_id
         )
         
@@ -496,14 +522,9 @@ async def run_agent_pipeline(
         # Stages 2 & 3: Writer and Paint Director (PARALLEL)
         # Both stages run concurrently since they only need the Director's outline
         
-        import asyncio
-        
-        # Event queue for interleaved streaming
-        event_queue = asyncio.Queue()
-        
-        # Completion tracking
-        writer_done = asyncio.Event()
-        paint_done = asyncio.Event()
+        # Event queue for interleaved streaming (bounded for backpressure)
+        event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+        paint_enabled = getattr(config, "enable_paint", True)
         
         # Results storage
         parallel_results = {
@@ -520,7 +541,9 @@ async def run_agent_pipeline(
             nonlocal full_response
             try:
                 writer_request = {}
-                async for chunk in run_writer(outline, chat_history, character, worldbook, config, writer_request):
+                async for chunk in run_writer(
+                    outline, chat_history, character, worldbook, config, writer_request, llm_config_cache
+                ):
                     parallel_results["writer_response"] += chunk
                     await event_queue.put({"type": "content", "content": chunk})
                 parallel_results["writer_request"] = writer_request
@@ -528,16 +551,13 @@ async def run_agent_pipeline(
                 parallel_results["writer_error"] = str(e)
                 print(f"Writer error: {e}")
             finally:
-                writer_done.set()
+                await event_queue.put(_STREAM_DONE)
         
         async def paint_task():
             """Run Paint Director stage and push events to queue."""
             try:
-                if not getattr(config, "enable_paint", True):
-                    return
-                    
                 async for chunk_or_url, prompt_or_none, is_final in run_paint_director(
-                    outline, chat_history, character, worldbook, session_id, config
+                    outline, chat_history, character, worldbook, session_id, config, llm_config_cache
                 ):
                     if is_final:
                         parallel_results["image_url"] = chunk_or_url
@@ -548,18 +568,19 @@ async def run_agent_pipeline(
                 parallel_results["paint_error"] = str(e)
                 print(f"Paint Director error: {e}")
             finally:
-                paint_done.set()
+                await event_queue.put(_STREAM_DONE)
         
         # Signal parallel stage start
         yield {"type": "stage", "stage": "writer"}
-        if getattr(config, "enable_paint", True):
+        if paint_enabled:
             yield {"type": "stage", "stage": "paint_director"}
         
         parallel_start = time.time()
         
         # Start both tasks concurrently
-        writer_task_handle = asyncio.create_task(writer_task())
-        paint_task_handle = asyncio.create_task(paint_task())
+        producers = [asyncio.create_task(writer_task())]
+        if paint_enabled:
+            producers.append(asyncio.create_task(paint_task()))
         
         # Log stage starts
         writer_stage_id = await start_stage_log(
@@ -567,27 +588,30 @@ async def run_agent_pipeline(
             config.writer_llm_config_id, config.writer_preset_id
         )
         paint_stage_id = None
-        if getattr(config, "enable_paint", True):
+        if paint_enabled:
             paint_stage_id = await start_stage_log(
                 run_id, "paint_director", outline,
                 config.painter_llm_config_id, config.painter_preset_id
             )
         
-        # Yield events as they arrive (interleaved)
-        while not (writer_done.is_set() and paint_done.is_set()):
-            try:
-                event = await asyncio.wait_for(event_queue.get(), timeout=0.05)
+        # Yield events as they arrive (interleaved) until every producer has finished
+        active_producers = len(producers)
+        try:
+            while active_producers:
+                event = await event_queue.get()
+                if event is _STREAM_DONE:
+                    active_producers -= 1
+                    continue
                 yield event
-            except asyncio.TimeoutError:
-                continue
-        
-        # Drain any remaining events in queue
-        while not event_queue.empty():
-            event = event_queue.get_nowait()
-            yield event
+        finally:
+            # Producers blocked on a full queue would otherwise outlive a closed stream
+            for task in producers:
+                task.cancel()
+            while not event_queue.empty():
+                event_queue.get_nowait()
         
         # Wait for both tasks to fully complete
-        await asyncio.gather(writer_task_handle, paint_task_handle, return_exceptions=True)
+        await asyncio.gather(*producers, return_exceptions=True)
         
         # Update full_response from parallel results
         full_response = parallel_results["writer_response"]
@@ -604,13 +628,11 @@ async def run_agent_pipeline(
             )
             yield {"type": "error", "stage": "writer", "message": parallel_results["writer_error"]}
         else:
-            # Update stage log with request structure
-            writer_request_json = json.dumps(parallel_results["writer_request"], ensure_ascii=False, indent=2)
             await complete_stage_log(writer_stage_id, full_response, parallel_duration)
         yield {"type": "stage_complete", "stage": "writer", "duration_ms": parallel_duration}
         
         # Log Paint Director completion
-        if getattr(config, "enable_paint", True):
+        if paint_enabled:
             if parallel_results["paint_error"]:
                 await complete_stage_log(
                     paint_stage_id, parallel_results["paint_error"], parallel_duration,
@@ -636,7 +658,8 @@ async def run_agent_pipeline(
             stage_start = time.time()
             stage_id = await start_stage_log(run_id, "tts", full_response)
             
-            dialogues = extract_dialogues(full_response)
+            # Regex-heavy extraction runs in a worker so other pipelines keep streaming
+            dialogues = await asyncio.to_thread(extract_dialogues, full_response)
             audio_results = await run_tts_for_dialogues(dialogues, session_id, config)
             
             stage_duration = int((time.time() - stage_start) * 1000)
@@ -681,27 +704,31 @@ async def run_agent_pipeline(
     
     # Save message to session
     if session:
-        # Add user message
-        session["messages"].append({
-            "id": generate_id(),
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.utcnow().isoformat(),
-        })
-        
-        # Add assistant message (with processed content)
-        session["messages"].append({
-            "id": generate_id(),
-            "role": "assistant",
-            "content": processed_response,  # Use regex-processed version
-            "timestamp": datetime.utcnow().isoformat(),
-            "image_url": image_url,
-            "image_prompt": image_prompt,
-            "audio_data": audio_results if audio_results else None,
-        })
+        now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        new_messages = [
+            # User message
+            {
+                "id": generate_id(),
+                "role": "user",
+                "content": user_message,
+                "timestamp": now,
+            },
+            # Assistant message (with processed content)
+            {
+                "id": generate_id(),
+                "role": "assistant",
+                "content": processed_response,  # Use regex-processed version
+                "timestamp": now,
+                "image_url": image_url,
+                "image_prompt": image_prompt,
+                "audio_data": audio_results if audio_results else None,
+            },
+        ]
+        session["messages"].extend(new_messages)
+        session["updated_at"] = now
         
-        session["updated_at"] = datetime.utcnow().isoformat()
-        await save_json(settings.data_dir / "chats" / f"{session_id}.json", session)
+        # Only the new turn is written; the session file is compacted lazily
+        await append_session_messages(session_id, new_messages)
     
     # Send processed_content in the "content" event for frontend to use
     yield {"type": "processed_content", "content": processed_response}
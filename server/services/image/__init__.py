@@ -1,6 +1,10 @@
 """
 Image generation services.
 """
-from .generator import generate_image, get_image_config
+from .generator import generate_image, get_image_config, invalidate_image_config_cache
 
-__all__ = ["generate_image", "get_image_config"]
+__all__ = [
+    "generate_image",
+    "get_image_config",
+    "invalidate_image_config_cache",
+]
@@ -3,29 +3,89 @@ Image Generation Service
 Supports: OpenAI (DALL-E), Stable Diffusion, ComfyUI, NovelAI
 """
 import httpx
-import aiosqlite
 import asyncio
-import base64
-import json
+import binascii
+import copy
+import functools
+import orjson
+import os
+import re
 import uuid
 import io
+import time
 import zipfile
 from typing import Optional
 
-from models import DATABASE_PATH
-from utils import decrypt_api_key, save_image, generate_id
+from config import settings
+from models import acquire_db
+from utils import decrypt_api_key_async, save_image, save_image_stream, generate_id, get_logger, get_http_client
+
+
+_log = get_logger(__name__)
+
+# Below DEBUG: per-message ComfyUI WebSocket chatter (status/progress/executing)
+_TRACE = 5
+
+
+# Image configs rarely change; cache lookups (keyed by config ID, None = active config)
+CONFIG_CACHE_TTL = 60.0
+_config_cache: dict[Optional[str], tuple[float, dict]] = {}
+
+
+def invalidate_image_config_cache():
+    """Drop cached image configs. Call after any write to image_configs."""
+    _config_cache.clear()
+    _parse_workflow.cache_clear()
 
 
 async def get_image_config(config_id: Optional[str] = None) -> Optional[dict]:
     """Get image configuration by ID or get active config."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
+    cached = _config_cache.get(config_id)
+    if cached and time.monotonic() - cached[0] < CONFIG_CACHE_TTL:
+        return cached[1]
+    
+    config = await _load_image_config(config_id)
+    if config:
+        _config_cache[config_id] = (time.monotonic(), config)
+    return config
+
+
+# Columns read by get_image_config. Extended columns may be missing from older
+# schemas, so they are selected with a literal fallback when absent.
+_CONFIG_COLS = ("id", "type", "base_url", "api_key_encrypted", "model", "size", "quality")
+_EXTENDED_CONFIG_COLS = {
+    "negative_prompt": "''",
+    "steps": "28",
+    "cfg_scale": "7.0",
+    "sampler": "''",
+    "workflow_json": "''",
+    "prompt_node_id": "NULL",
+}
+_config_select: Optional[str] = None
+
+
+async def _get_config_select(db) -> str:
+    """Build the image config SELECT once, based on the columns the table has."""
+    global _config_select
+    if _config_select is None:
+        async with db.execute("PRAGMA table_info(image_configs)") as cursor:
+            present = {row["name"] for row in await cursor.fetchall()}
+        columns = [
+            *_CONFIG_COLS,
+            *(col if col in present else f"{default} AS {col}" for col, default in _EXTENDED_CONFIG_COLS.items()),
+        ]
+        _config_select = f"SELECT {', '.join(columns)} FROM image_configs"
+    return _config_select
+
+
+async def _load_image_config(config_id: Optional[str]) -> Optional[dict]:
+    async with acquire_db() as db:
+        select = await _get_config_select(db)
         if config_id:
-            query = "SELECT * FROM image_configs WHERE id = ?"
+            query = f"{select} WHERE id = ?"
             params = (config_id,)
         else:
-            query = "SELECT * FROM image_configs WHERE is_active = 1"
+            query = f"{select} WHERE is_active = 1"
             params = ()
         
         async with db.execute(query, params) as cursor:
@@ -37,20 +97,91 @@ async def get_image_config(config_id: Optional[str] = None) -> Optional[dict]:
                 "id": row["id"],
                 "type": row["type"],
                 "base_url": row["base_url"],
-                "api_key": decrypt_api_key(row["api_key_encrypted"]),
+                "api_key": await decrypt_api_key_async(row["api_key_encrypted"]),
                 "model": row["model"],
                 "size": row["size"] or "1024x1024",
                 "quality": row["quality"] or "standard",
-                # Extended parameters (with fallbacks for old schemas)
-                "negative_prompt": row["negative_prompt"] if "negative_prompt" in row.keys() else "",
-                "steps": row["steps"] if "steps" in row.keys() else 28,
-                "cfg_scale": row["cfg_scale"] if "cfg_scale" in row.keys() else 7.0,
-                "sampler": row["sampler"] if "sampler" in row.keys() else "",
-                "workflow_json": row["workflow_json"] if "workflow_json" in row.keys() else "",
-                "prompt_node_id": row["prompt_node_id"] if "prompt_node_id" in row.keys() else None,
+                "negative_prompt": row["negative_prompt"],
+                "steps": row["steps"],
+                "cfg_scale": row["cfg_scale"],
+                "sampler": row["sampler"],
+                "workflow_json": row["workflow_json"],
+                "prompt_node_id": row["prompt_node_id"],
             }
 
 
+def _error_text(response: httpx.Response, limit: int = 512) -> str:
+    """Decode only the head of an error body (misconfigured endpoints can return large HTML pages)."""
+    return response.content[:limit].decode("utf-8", "replace")
+
+
+# Base64 is decoded in slices that are a multiple of 4 chars (64KB in, 48KB out)
+B64_CHUNK_SIZE = 64 * 1024
+
+
+def _find_b64_field(content: bytes, field: str):
+    """
+    Locate the first base64 string value of a JSON field in a raw response body.
+    
+    Image APIs return multi-MB base64 payloads; slicing the value out of the
+    response bytes avoids materializing the whole body as Python str/dict first.
+    Returns None if the field can't be located or its value uses escapes other
+    than "\\/", so callers can fall back to a full JSON parse.
+    """
+    key = f'"{field}"'.encode()
+    pos = content.find(key)
+    if pos == -1:
+        return None
+    pos += len(key)
+    start = content.find(b'"', pos)
+    # Only ':' / '[' and whitespace may sit between the key and its string value
+    if start == -1 or content[pos:start].strip(b' \t\r\n:['):
+        return None
+    end = content.find(b'"', start + 1)
+    if end == -1:
+        return None
+    if content.find(b'\\', start + 1, end) != -1:
+        # JSON "\/" escapes would break 4-char alignment of the chunks; any other
+        # escape (including an escaped quote ending the slice early) isn't base64
+        value = content[start + 1:end]
+        if value.replace(b'\\/', b'').find(b'\\') != -1:
+            return None
+        return value.replace(b'\\/', b'/')
+    return memoryview(content)[start + 1:end]
+
+
+def _iter_b64_decode(data, chunk_size: int = B64_CHUNK_SIZE):
+    """
+    Decode base64 (bytes, memoryview or ASCII str) in aligned slices.
+    
+    A str comes from a full JSON parse and may be line-wrapped; the whitespace is
+    dropped first so every slice stays a multiple of 4 characters.
+    """
+    if isinstance(data, str):
+        data = "".join(data.split())
+    for i in range(0, len(data), chunk_size):
+        yield binascii.a2b_base64(data[i:i + chunk_size])
+
+
+# The sizes offered in the UI, pre-parsed
+_SIZE_CACHE = {
+    size: tuple(map(int, size.split("x")))
+    for size in ("512x512", "768x768", "1024x1024", "1024x1792", "1792x1024", "512x768", "768x512")
+}
+
+
+def _parse_size(size: str) -> tuple[int, int]:
+    """Parse a "WxH" size string, falling back to 1024x1024."""
+    parsed = _SIZE_CACHE.get(size)
+    if parsed is not None:
+        return parsed
+    try:
+        width, height = map(int, size.split("x"))
+    except (ValueError, AttributeError):
+        return 1024, 1024
+    return width, height
+
+
 async def generate_image(
     prompt: str,
     chat_session_id: str,
@@ -92,35 +223,36 @@ async def generate_openai_image(
     base_url = config["base_url"].rstrip("/")
     api_key = config["api_key"]
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{base_url}/images/generations",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": config.get("model", "dall-e-3"),
-                "prompt": prompt,
-                "n": 1,
-                "size": config.get("size", "1024x1024"),
-                "quality": config.get("quality", "standard"),
-                "response_format": "b64_json",
-            },
-            timeout=120.0
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"OpenAI API error: {response.text}")
-        
-        data = response.json()
+    client = get_http_client()
+    response = await client.post(
+        f"{base_url}/images/generations",
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        },
+        content=orjson.dumps({
+            "model": config.get("model", "dall-e-3"),
+            "prompt": prompt,
+            "n": 1,
+            "size": config.get("size", "1024x1024"),
+            "quality": config.get("quality", "standard"),
+            "response_format": "b64_json",
+        }),
+        timeout=120.0
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"OpenAI API error: {_error_text(response)}")
+    
+    image_b64 = _find_b64_field(response.content, "b64_json")
+    if image_b64 is None:
+        data = orjson.loads(response.content)
         image_b64 = data["data"][0]["b64_json"]
-        image_data = base64.b64decode(image_b64)
-        
-        # Save image
-        filename = f"{generate_id()}.png"
-        image_url = await save_image(image_data, chat_session_id, filename)
-        return image_url
+    
+    # Save image
+    filename = f"{generate_id()}.png"
+    image_url = await save_image_stream(_iter_b64_decode(image_b64), chat_session_id, filename)
+    return image_url
 
 
 async def generate_sd_image(
@@ -132,43 +264,45 @@ async def generate_sd_image(
     base_url = config["base_url"].rstrip("/")
     api_key = config["api_key"]
     
-    # Parse size
-    size = config.get("size", "1024x1024")
-    try:
-        width, height = map(int, size.split("x"))
-    except ValueError:
-        width, height = 1024, 1024
+    width, height = _parse_size(config.get("size", "1024x1024"))
     
     headers = {"Content-Type": "application/json"}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{base_url}/sdapi/v1/txt2img",
-            headers=headers,
-            json={
-                "prompt": prompt,
-                "negative_prompt": config.get("negative_prompt", ""),
-                "steps": config.get("steps", 28),
-                "cfg_scale": config.get("cfg_scale", 7.0),
-                "width": width,
-                "height": height,
-                "sampler_name": config.get("sampler", "Euler a") or "Euler a",
-            },
-            timeout=180.0
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Stable Diffusion API error: {response.text}")
-        
-        data = response.json()
+    client = get_http_client()
+    response = await client.post(
+        f"{base_url}/sdapi/v1/txt2img",
+        headers=headers,
+        content=orjson.dumps({
+            "prompt": prompt,
+            "negative_prompt": config.get("negative_prompt", ""),
+            "steps": config.get("steps", 28),
+            "cfg_scale": config.get("cfg_scale", 7.0),
+            "width": width,
+            "height": height,
+            "sampler_name": config.get("sampler", "Euler a") or "Euler a",
+        }),
+        timeout=180.0
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"Stable Diffusion API error: {_error_text(response)}")
+    
+    image_b64 = _find_b64_field(response.content, "images")
+    if image_b64 is None:
+        data = orjson.loads(response.content)
         image_b64 = data["images"][0]
-        image_data = base64.b64decode(image_b64)
-        
-        filename = f"{generate_id()}.png"
-        image_url = await save_image(image_data, chat_session_id, filename)
-        return image_url
+    
+    filename = f"{generate_id()}.png"
+    image_url = await save_image_stream(_iter_b64_decode(image_b64), chat_session_id, filename)
+    return image_url
+
+
+COMFYUI_TIMEOUT = 180.0
+COMFYUI_POLL_INTERVAL = 1.0
+PROGRESS_LOG_INTERVAL = 0.5
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 async def generate_comfyui_image(
@@ -177,47 +311,44 @@ async def generate_comfyui_image(
     config: dict
 ) -> str:
     """
-    Generate image using ComfyUI API with WebSocket polling.
+    Generate image using ComfyUI API, polling /history for completion
+    (or following the WebSocket when comfyui_ws_progress is enabled).
     Supports custom workflow JSON or uses a default txt2img workflow.
     """
-    import websockets
-    
-    print(f"\n=== ComfyUI Image Generation Started ===")
-    print(f"  Prompt (first 100 chars): {prompt[:100]}...")
-    print(f"  Config type: {config.get('type')}")
-    print(f"  Base URL: {config.get('base_url')}")
-    print(f"  Prompt Node ID: {config.get('prompt_node_id')}")
-    print(f"  Has workflow_json: {bool(config.get('workflow_json'))}")
+    _log.debug("=== ComfyUI Image Generation Started ===")
+    _log.debug("Prompt (first 100 chars): %s...", prompt[:100])
+    _log.debug("Config type: %s", config.get('type'))
+    _log.debug("Base URL: %s", config.get('base_url'))
+    _log.debug("Prompt Node ID: %s", config.get('prompt_node_id'))
+    _log.debug("Has workflow_json: %s", bool(config.get('workflow_json')))
     
     base_url = config["base_url"].rstrip("/")
-    client_id = str(uuid.uuid4())
+    # One urandom read covers the client ID, the saved filename and the workflow seed
+    rnd = os.urandom(36)
+    client_id = uuid.UUID(bytes=rnd[:16]).hex
     
-    # Parse size
-    size = config.get("size", "1024x1024")
-    try:
-        width, height = map(int, size.split("x"))
-    except ValueError:
-        width, height = 1024, 1024
+    width, height = _parse_size(config.get("size", "1024x1024"))
     
     # Build workflow
-    print(f"\n[Step 1] Building workflow...")
+    _log.debug("[Step 1] Building workflow...")
     if config.get("workflow_json"):
         # Use custom workflow
         try:
-            workflow_prompt = json.loads(config["workflow_json"])
-            print(f"  Parsed custom workflow with {len(workflow_prompt)} nodes")
+            workflow_prompt = _get_workflow(config["workflow_json"])
+            _log.debug("Parsed custom workflow with %s nodes", len(workflow_prompt))
             # Inject prompt into the workflow
             workflow_prompt = inject_prompt_into_workflow(
                 workflow_prompt, prompt, config.get("negative_prompt", ""),
-                prompt_node_id=config.get("prompt_node_id")
+                prompt_node_id=config.get("prompt_node_id"),
+                seed_bytes=rnd[32:36]
             )
-            print(f"  Prompt injected into workflow")
-        except json.JSONDecodeError as e:
-            print(f"  ERROR: Invalid workflow JSON: {e}")
+            _log.debug("Prompt injected into workflow")
+        except orjson.JSONDecodeError as e:
+            _log.error("Invalid workflow JSON: %s", e)
             raise Exception("Invalid workflow JSON format")
     else:
         # Use default txt2img workflow
-        print(f"  Using default txt2img workflow")
+        _log.debug("Using default txt2img workflow")
         workflow_prompt = build_default_comfyui_workflow(
             prompt=prompt,
             negative_prompt=config.get("negative_prompt", "bad quality, blurry, worst quality"),
@@ -230,142 +361,202 @@ async def generate_comfyui_image(
         )
     
     # Queue the prompt
-    print(f"\n[Step 2] Queuing prompt to ComfyUI...")
-    print(f"  URL: {base_url}/prompt")
+    _log.debug("[Step 2] Queuing prompt to ComfyUI...")
+    _log.debug("URL: %s/prompt", base_url)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{base_url}/prompt",
-                json={"prompt": workflow_prompt, "client_id": client_id},
-                timeout=30.0
-            )
-            
-            print(f"  Response status: {response.status_code}")
-            if response.status_code != 200:
-                error_text = response.text
-                print(f"  ERROR: {error_text}")
-                raise Exception(f"ComfyUI queue error ({response.status_code}): {error_text}")
-            
-            result = response.json()
-            prompt_id = result["prompt_id"]
-            print(f"  Prompt ID: {prompt_id}")
+        client = get_http_client()
+        response = await client.post(
+            f"{base_url}/prompt",
+            headers={"Content-Type": "application/json"},
+            content=orjson.dumps({"prompt": workflow_prompt, "client_id": client_id}),
+            timeout=30.0
+        )
+        
+        _log.debug("Response status: %s", response.status_code)
+        if response.status_code != 200:
+            error_text = _error_text(response)
+            _log.error("ComfyUI queue error: %s", error_text)
+            raise Exception(f"ComfyUI queue error ({response.status_code}): {error_text}")
+        
+        result = orjson.loads(response.content)
+        prompt_id = result["prompt_id"]
+        _log.debug("Prompt ID: %s", prompt_id)
     except httpx.ConnectError as e:
-        print(f"  ERROR: Cannot connect to ComfyUI at {base_url}")
-        print(f"  Details: {e}")
+        _log.error("Cannot connect to ComfyUI at %s: %s", base_url, e)
         raise Exception(f"Cannot connect to ComfyUI at {base_url}. Is ComfyUI running?")
     except Exception as e:
-        print(f"  ERROR: {type(e).__name__}: {e}")
+        _log.error("%s: %s", type(e).__name__, e)
         raise
     
-    # Poll via WebSocket for completion
-    print(f"\n[Step 3] Waiting for ComfyUI execution (WebSocket)...")
-    ws_url = base_url.replace("http://", "ws://").replace("https://", "wss://")
-    ws_full_url = f"{ws_url}/ws?clientId={client_id}"
-    print(f"  WebSocket URL: {ws_full_url}")
-    
-    try:
-        async with websockets.connect(ws_full_url) as ws:
-            print(f"  WebSocket connected")
-            while True:
-                try:
-                    msg = await asyncio.wait_for(ws.recv(), timeout=180.0)
-                    data = json.loads(msg)
-                    
-                    msg_type = data.get("type")
-                    if msg_type == "status":
-                        queue_remaining = data.get("data", {}).get("status", {}).get("exec_info", {}).get("queue_remaining", "?")
-                        print(f"  Status: queue_remaining={queue_remaining}")
-                    elif msg_type == "executing":
-                        exec_data = data.get("data", {})
-                        node = exec_data.get("node")
-                        if exec_data.get("prompt_id") == prompt_id:
-                            if node is None:
-                                print(f"  Execution complete!")
-                                break
-                            else:
-                                print(f"  Executing node: {node}")
-                    elif msg_type == "execution_error":
-                        error_data = data.get("data", {})
-                        print(f"  EXECUTION ERROR: {error_data}")
-                        raise Exception(f"ComfyUI execution error: {error_data}")
-                    elif msg_type == "progress":
-                        progress = data.get("data", {})
-                        print(f"  Progress: {progress.get('value', 0)}/{progress.get('max', 0)}")
-                        
-                except asyncio.TimeoutError:
-                    print(f"  ERROR: Timeout after 180 seconds")
-                    raise Exception("ComfyUI generation timed out after 180 seconds")
-    except websockets.exceptions.ConnectionClosedError as e:
-        print(f"  ERROR: WebSocket closed unexpectedly: {e}")
-        raise Exception(f"ComfyUI WebSocket closed: {e}")
-    except Exception as e:
-        if "websockets" in str(type(e).__module__):
-            print(f"  ERROR: WebSocket connection failed: {e}")
-            raise Exception(f"ComfyUI WebSocket connection failed: {e}")
-        print(f"  ERROR: {type(e).__name__}: {e}")
-        raise
-    
-    # Fetch the history to get the output image
-    print(f"\n[Step 4] Fetching execution history...")
-    async with httpx.AsyncClient() as client:
-        history_url = f"{base_url}/history/{prompt_id}"
-        print(f"  URL: {history_url}")
-        response = await client.get(history_url, timeout=30.0)
-        print(f"  Response status: {response.status_code}")
+    # Wait for completion: poll /history, or follow the WebSocket for live progress
+    history_entry = None
+    image_info = None
+    if settings.comfyui_ws_progress:
+        import websockets
         
-        if response.status_code != 200:
-            print(f"  ERROR: {response.text}")
-            raise Exception(f"ComfyUI history fetch error: {response.text}")
-        
-        history = response.json()
+        _log.debug("[Step 3] Waiting for ComfyUI execution (WebSocket)...")
+        if base_url.startswith("https://"):
+            ws_url = "wss://" + base_url[8:]
+        elif base_url.startswith("http://"):
+            ws_url = "ws://" + base_url[7:]
+        else:
+            ws_url = base_url
+        ws_full_url = f"{ws_url}/ws?clientId={client_id}"
+        _log.debug("WebSocket URL: %s", ws_full_url)
         
-        if prompt_id not in history:
-            print(f"  ERROR: Prompt ID not found in history")
-            raise Exception("ComfyUI execution not found in history")
+        last_progress_log = 0.0
+        try:
+            async with websockets.connect(ws_full_url) as ws:
+                _log.debug("WebSocket connected")
+                while True:
+                    try:
+                        msg = await asyncio.wait_for(ws.recv(), timeout=180.0)
+                        data = orjson.loads(msg)
+                        
+                        msg_type = data.get("type")
+                        if msg_type == "status":
+                            queue_remaining = data.get("data", {}).get("status", {}).get("exec_info", {}).get("queue_remaining", "?")
+                            _log.log(_TRACE, "Status: queue_remaining=%s", queue_remaining)
+                        elif msg_type == "executing":
+                            exec_data = data.get("data", {})
+                            node = exec_data.get("node")
+                            if exec_data.get("prompt_id") == prompt_id:
+                                if node is None:
+                                    _log.debug("Execution complete!")
+                                    break
+                                else:
+                                    _log.log(_TRACE, "Executing node: %s", node)
+                        elif msg_type == "executed":
+                            # Output nodes report their images here, which saves a /history fetch
+                            exec_data = data.get("data", {})
+                            if image_info is None and exec_data.get("prompt_id") == prompt_id:
+                                images = (exec_data.get("output") or {}).get("images")
+                                if images:
+                                    image_info = images[0]
+                                    _log.debug("Found image in node %s: %s", exec_data.get("node"), image_info)
+                        elif msg_type == "execution_error":
+                            error_data = data.get("data", {})
+                            _log.error("Execution error: %s", error_data)
+                            raise Exception(f"ComfyUI execution error: {error_data}")
+                        elif msg_type == "progress":
+                            # Samplers report every step; log at most every PROGRESS_LOG_INTERVAL
+                            if _log.isEnabledFor(_TRACE):
+                                now = time.monotonic()
+                                if now - last_progress_log >= PROGRESS_LOG_INTERVAL:
+                                    last_progress_log = now
+                                    progress = data.get("data", {})
+                                    _log.log(_TRACE, "Progress: %s/%s", progress.get('value', 0), progress.get('max', 0))
+                            
+                    except asyncio.TimeoutError:
+                        _log.error("Timeout after 180 seconds")
+                        raise Exception("ComfyUI generation timed out after 180 seconds")
+        except websockets.exceptions.ConnectionClosedError as e:
+            _log.error("WebSocket closed unexpectedly: %s", e)
+            raise Exception(f"ComfyUI WebSocket closed: {e}")
+        except Exception as e:
+            if "websockets" in str(type(e).__module__):
+                _log.error("WebSocket connection failed: %s", e)
+                raise Exception(f"ComfyUI WebSocket connection failed: {e}")
+            _log.error("%s: %s", type(e).__name__, e)
+            raise
+    else:
+        _log.debug("[Step 3] Waiting for ComfyUI execution (polling history)...")
+        history_url = f"{base_url}/history/{prompt_id}"
+        deadline = time.monotonic() + COMFYUI_TIMEOUT
+        while True:
+            try:
+                response = await client.get(history_url, timeout=5.0)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                # A slow or dropped poll doesn't mean the generation failed
+                _log.debug("History poll failed, retrying: %s", e)
+                response = None
+            if response is not None and response.status_code == 200:
+                entry = orjson.loads(response.content).get(prompt_id)
+                if entry:
+                    status = entry.get("status", {})
+                    if status.get("status_str") == "error":
+                        _log.error("Execution error: %s", status.get('messages'))
+                        raise Exception(f"ComfyUI execution error: {status.get('messages')}")
+                    if entry.get("outputs") or status.get("completed"):
+                        _log.debug("Execution complete!")
+                        history_entry = entry
+                        break
+            if time.monotonic() >= deadline:
+                _log.error("Timeout after %.0f seconds", COMFYUI_TIMEOUT)
+                raise Exception(f"ComfyUI generation timed out after {COMFYUI_TIMEOUT:.0f} seconds")
+            await asyncio.sleep(COMFYUI_POLL_INTERVAL)
+    
+    if image_info is None:
+        if history_entry is None:
+            # Fetch the history to get the output image
+            _log.debug("[Step 4] Fetching execution history...")
+            history_url = f"{base_url}/history/{prompt_id}"
+            _log.debug("URL: %s", history_url)
+            response = await client.get(history_url, timeout=30.0)
+            _log.debug("Response status: %s", response.status_code)
+            
+            if response.status_code != 200:
+                error_text = _error_text(response)
+                _log.error("ComfyUI history fetch error: %s", error_text)
+                raise Exception(f"ComfyUI history fetch error: {error_text}")
+            
+            history = orjson.loads(response.content)
+            
+            if prompt_id not in history:
+                _log.error("Prompt ID not found in history")
+                raise Exception("ComfyUI execution not found in history")
+            
+            history_entry = history[prompt_id]
         
-        outputs = history[prompt_id].get("outputs", {})
-        print(f"  Found {len(outputs)} output node(s)")
+        outputs = history_entry.get("outputs", {})
+        _log.debug("Found %s output node(s)", len(outputs))
         
         # Find the SaveImage node output
-        image_info = None
         for node_id, node_output in outputs.items():
             if "images" in node_output:
                 image_info = node_output["images"][0]
-                print(f"  Found image in node {node_id}: {image_info}")
+                _log.debug("Found image in node %s: %s", node_id, image_info)
                 break
         
         if not image_info:
-            print(f"  ERROR: No image found in any output node")
-            print(f"  Available outputs: {list(outputs.keys())}")
+            _log.error("No image found in any output node (outputs: %s)", list(outputs.keys()))
             raise Exception("No image found in ComfyUI output")
-        
-        # Download the image
-        print(f"\n[Step 5] Downloading image...")
-        filename = image_info["filename"]
-        subfolder = image_info.get("subfolder", "")
-        img_type = image_info.get("type", "output")
-        
-        view_url = f"{base_url}/view?filename={filename}&subfolder={subfolder}&type={img_type}"
-        print(f"  URL: {view_url}")
-        response = await client.get(view_url, timeout=30.0)
-        print(f"  Response status: {response.status_code}")
+    
+    # Download the image
+    _log.debug("[Step 5] Downloading image...")
+    filename = image_info["filename"]
+    subfolder = image_info.get("subfolder", "")
+    img_type = image_info.get("type", "output")
+    
+    view_url = f"{base_url}/view?filename={filename}&subfolder={subfolder}&type={img_type}"
+    _log.debug("URL: %s", view_url)
+    async with client.stream("GET", view_url, timeout=30.0) as response:
+        _log.debug("Response status: %s", response.status_code)
         
         if response.status_code != 200:
-            print(f"  ERROR: Image download failed")
+            _log.error("Image download failed")
             raise Exception(f"ComfyUI image download error: {response.status_code}")
         
-        image_data = response.content
-        print(f"  Downloaded {len(image_data)} bytes")
+        # Stream straight to disk instead of buffering the whole image
+        save_filename = f"{rnd[16:32].hex()}.png"
+        image_url = await save_image_stream(response.aiter_bytes(DOWNLOAD_CHUNK_SIZE), chat_session_id, save_filename)
+        _log.debug("Downloaded %s bytes", response.num_bytes_downloaded)
     
-    # Save image
-    print(f"\n[Step 6] Saving image locally...")
-    save_filename = f"{generate_id()}.png"
-    image_url = await save_image(image_data, chat_session_id, save_filename)
-    print(f"  Saved as: {image_url}")
-    print(f"=== ComfyUI Image Generation Complete ===\n")
+    _log.debug("Saved as: %s", image_url)
+    _log.debug("=== ComfyUI Image Generation Complete ===")
     return image_url
 
 
+@functools.lru_cache(maxsize=32)
+def _parse_workflow(workflow_json: str) -> dict:
+    return orjson.loads(workflow_json)
+
+
+def _get_workflow(workflow_json: str) -> dict:
+    """Parse a custom workflow once per distinct JSON text; callers get a private copy to mutate."""
+    return copy.deepcopy(_parse_workflow(workflow_json))
+
+
 def build_default_comfyui_workflow(
     prompt: str,
     negative_prompt: str,
@@ -420,11 +611,41 @@ def build_default_comfyui_workflow(
     }
 
 
+_NEG_RE = re.compile(r"bad|worst|ugly|blurry|low quality|deformed", re.IGNORECASE)
+_PLACEHOLDERS = ("{{PROMPT}}", "{{NEGATIVE}}", "{{SEED}}")
+
+
+def _has_placeholder(obj) -> bool:
+    """Check whether any string leaf in a workflow contains a placeholder."""
+    if isinstance(obj, str):
+        return "{{" in obj and any(p in obj for p in _PLACEHOLDERS)
+    if isinstance(obj, dict):
+        return any(_has_placeholder(v) for v in obj.values())
+    if isinstance(obj, list):
+        return any(_has_placeholder(v) for v in obj)
+    return False
+
+
+def _substitute(obj, mapping: dict):
+    """Replace placeholders in every string leaf of a workflow, returning new containers."""
+    if isinstance(obj, str):
+        if "{{" in obj:
+            for placeholder, value in mapping.items():
+                obj = obj.replace(placeholder, value)
+        return obj
+    if isinstance(obj, dict):
+        return {k: _substitute(v, mapping) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_substitute(v, mapping) for v in obj]
+    return obj
+
+
 def inject_prompt_into_workflow(
     workflow: dict, 
     prompt: str, 
     negative_prompt: str,
-    prompt_node_id: str = None
+    prompt_node_id: str = None,
+    seed_bytes: bytes = None
 ) -> dict:
     """
     Inject prompt text into a custom ComfyUI workflow.
@@ -433,9 +654,9 @@ def inject_prompt_into_workflow(
     1. Node ID mode: If prompt_node_id specified, inject directly into that node
     2. Placeholder mode: Replace {{PROMPT}}, {{NEGATIVE}}, {{SEED}} placeholders
     3. Heuristic mode: Fall back to CLIPTextEncode detection
-    """
-    import random
     
+    seed_bytes supplies the random {{SEED}} (4 bytes); drawn from os.urandom if omitted.
+    """
     # Priority 1: Direct node ID targeting
     if prompt_node_id and prompt_node_id in workflow:
         node = workflow[prompt_node_id]
@@ -447,7 +668,7 @@ def inject_prompt_into_workflow(
                 inputs["text"] = prompt
             # If text is a list (linked input), we can't replace it - log warning
             else:
-                print(f"Warning: Node {prompt_node_id} has linked text input, cannot inject directly")
+                _log.warning("Node %s has linked text input, cannot inject directly", prompt_node_id)
         else:
             # Try common alternative field names
             for field in ["prompt", "string", "content", "input"]:
@@ -457,23 +678,13 @@ def inject_prompt_into_workflow(
         return workflow
     
     # Priority 2: Placeholder mode
-    workflow_str = json.dumps(workflow, ensure_ascii=False)
-    
-    has_prompt_placeholder = "{{PROMPT}}" in workflow_str
-    has_negative_placeholder = "{{NEGATIVE}}" in workflow_str
-    has_seed_placeholder = "{{SEED}}" in workflow_str
-    
-    if has_prompt_placeholder or has_negative_placeholder or has_seed_placeholder:
-        # Placeholder mode: string replacement
-        escaped_prompt = prompt.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-        escaped_negative = negative_prompt.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-        random_seed = str(random.randint(0, 2**32 - 1))
-        
-        workflow_str = workflow_str.replace("{{PROMPT}}", escaped_prompt)
-        workflow_str = workflow_str.replace("{{NEGATIVE}}", escaped_negative)
-        workflow_str = workflow_str.replace("{{SEED}}", random_seed)
-        
-        return json.loads(workflow_str)
+    if _has_placeholder(workflow):
+        mapping = {
+            "{{PROMPT}}": prompt,
+            "{{NEGATIVE}}": negative_prompt,
+            "{{SEED}}": str(int.from_bytes(seed_bytes or os.urandom(4), "little")),
+        }
+        return _substitute(workflow, mapping)
     
     # Priority 3: Fall back to CLIPTextEncode heuristic
     for node_id, node in workflow.items():
@@ -485,11 +696,8 @@ def inject_prompt_into_workflow(
             if isinstance(current_text, list):
                 continue
                 
-            current_text_lower = current_text.lower()
-            
             # Heuristic: if current text contains negative keywords, it's likely the negative prompt
-            negative_keywords = ["bad", "worst", "ugly", "blurry", "low quality", "deformed"]
-            is_negative = any(kw in current_text_lower for kw in negative_keywords)
+            is_negative = _NEG_RE.search(current_text) is not None
             
             if is_negative:
                 inputs["text"] = negative_prompt if negative_prompt else current_text
@@ -499,6 +707,10 @@ def inject_prompt_into_workflow(
     return workflow
 
 
+_PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
 async def generate_novelai_image(
     prompt: str,
     chat_session_id: str,
@@ -510,12 +722,7 @@ async def generate_novelai_image(
     """
     api_key = config["api_key"]
     
-    # Parse size
-    size = config.get("size", "1024x1024")
-    try:
-        width, height = map(int, size.split("x"))
-    except ValueError:
-        width, height = 1024, 1024
+    width, height = _parse_size(config.get("size", "1024x1024"))
     
     # Clamp dimensions to NovelAI limits
     width = max(64, min(width, 1024))
@@ -550,42 +757,41 @@ async def generate_novelai_image(
         }
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://image.novelai.net/ai/generate-image",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "Accept": "application/zip",
-            },
-            json=request_body,
-            timeout=180.0
-        )
-        
-        if response.status_code == 401:
-            raise Exception("NovelAI authentication failed - check API token")
-        elif response.status_code == 402:
-            raise Exception("NovelAI insufficient Anlas - check subscription")
-        elif response.status_code != 200:
-            raise Exception(f"NovelAI API error: {response.status_code} - {response.text[:200]}")
-        
-        # Response is a ZIP file containing the image
-        try:
-            zip_data = io.BytesIO(response.content)
-            with zipfile.ZipFile(zip_data, 'r') as zip_file:
-                # Get the first PNG file
-                for name in zip_file.namelist():
-                    if name.endswith('.png'):
-                        image_data = zip_file.read(name)
-                        break
-                else:
-                    raise Exception("No PNG found in NovelAI response")
-        except zipfile.BadZipFile:
-            # Some responses might be raw PNG
-            if response.content[:8] == b'\x89PNG\r\n\x1a\n':
-                image_data = response.content
-            else:
-                raise Exception("Invalid response format from NovelAI")
+    client = get_http_client()
+    response = await client.post(
+        "https://image.novelai.net/ai/generate-image",
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/zip",
+        },
+        content=orjson.dumps(request_body),
+        timeout=180.0
+    )
+    
+    if response.status_code == 401:
+        raise Exception("NovelAI authentication failed - check API token")
+    elif response.status_code == 402:
+        raise Exception("NovelAI insufficient Anlas - check subscription")
+    elif response.status_code != 200:
+        raise Exception(f"NovelAI API error: {response.status_code} - {_error_text(response, 200)}")
+    
+    # Response is usually a ZIP file containing the image, but may be a raw PNG
+    content = response.content
+    if content[:8] == _PNG_MAGIC:
+        image_data = content
+    elif content[:4] == _ZIP_MAGIC:
+        with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_file:
+            # Get the first PNG file, inflating straight into a buffer of its known size
+            info = next((i for i in zip_file.infolist() if i.filename.endswith('.png')), None)
+            if info is None:
+                raise Exception("No PNG found in NovelAI response")
+            image_data = bytearray(info.file_size)
+            with zip_file.open(info) as f:
+                if f.readinto(image_data) != info.file_size:
+                    raise Exception("Truncated PNG in NovelAI response")
+    else:
+        raise Exception("Invalid response format from NovelAI")
     
     # Save image
     filename = f"{generate_id()}.png"
@@ -5,6 +5,7 @@ from .stream_handler import (
     stream_completion,
     get_completion,
     get_llm_config,
+    invalidate_llm_config_cache,
     set_abort,
     clear_abort,
     should_abort,
@@ -14,6 +15,7 @@ __all__ = [
     "stream_completion",
     "get_completion",
     "get_llm_config",
+    "invalidate_llm_config_cache",
     "set_abort",
     "clear_abort",
     "should_abort",
@@ -2,29 +2,30 @@
 LLM Stream Handler - Handles streaming responses from OpenAI-compatible APIs
 """
 import httpx
-import json
+import orjson
 import time
-import aiosqlite
-from collections import OrderedDict
+from functools import lru_cache
 from typing import AsyncIterator, Optional
 
-from models import DATABASE_PATH
-from utils import decrypt_api_key, get_logger
+from models import acquire_db
+from utils import decrypt_api_key_async, get_logger, get_http_client
 
 # Set up module logger
 logger = get_logger("llm.stream")
 
 # Global abort controller for stopping requests with memory limit
-_abort_flags: OrderedDict[str, bool] = OrderedDict()
 MAX_ABORT_FLAGS = 500  # Prevent memory growth
+# Insertion-ordered (dict keys) so the oldest flag is evicted first
+_abort_flags: dict[str, None] = {}
 
 
 def set_abort(session_id: str):
     """Set abort flag for a session."""
-    _abort_flags[session_id] = True
-    # Cleanup old entries to prevent memory leak
-    while len(_abort_flags) > MAX_ABORT_FLAGS:
-        _abort_flags.popitem(last=False)
+    if session_id not in _abort_flags:
+        # Cleanup the oldest entry to prevent memory leak
+        if len(_abort_flags) >= MAX_ABORT_FLAGS:
+            del _abort_flags[next(iter(_abort_flags))]
+        _abort_flags[session_id] = None
     logger.debug("Abort flag set for session %s", session_id)
 
 
@@ -35,14 +36,33 @@ def clear_abort(session_id: str):
 
 def should_abort(session_id: str) -> bool:
     """Check if session should abort."""
-    return _abort_flags.get(session_id, False)
+    return session_id in _abort_flags
+
+
+# Decrypted configs, cached briefly (keyed by config ID, None = active config)
+CONFIG_CACHE_TTL = 30.0
+_config_cache: dict[Optional[str], tuple[float, dict]] = {}
+
+
+def invalidate_llm_config_cache():
+    """Drop cached LLM configs. Call after any write to llm_configs."""
+    _config_cache.clear()
 
 
 async def get_llm_config(config_id: Optional[str] = None) -> Optional[dict]:
     """Get LLM configuration by ID or get active config."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
+    cached = _config_cache.get(config_id)
+    if cached and time.monotonic() - cached[0] < CONFIG_CACHE_TTL:
+        return cached[1]
+    
+    config = await _load_llm_config(config_id)
+    if config:
+        _config_cache[config_id] = (time.monotonic(), config)
+    return config
+
+
+async def _load_llm_config(config_id: Optional[str]) -> Optional[dict]:
+    async with acquire_db() as db:
         if config_id:
             query = "SELECT * FROM llm_configs WHERE id = ?"
             params = (config_id,)
@@ -59,11 +79,49 @@ async def get_llm_config(config_id: Optional[str] = None) -> Optional[dict]:
                 "id": row["id"],
                 "name": row["name"],
                 "base_url": row["base_url"],
-                "api_key": decrypt_api_key(row["api_key_encrypted"]),
+                "api_key": await decrypt_api_key_async(row["api_key_encrypted"]),
                 "model": row["default_model"],
             }
 
 
+STREAM_TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=10.0)
+COMPLETION_TIMEOUT = httpx.Timeout(120.0)
+
+
+@lru_cache(maxsize=32)
+def _request_headers(api_key: str, stream: bool) -> dict:
+    """Request headers per API key; built once and shared, httpx copies them per request."""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    if stream:
+        # Compressed SSE gets buffered by the decoder; keep the stream raw
+        headers["Accept-Encoding"] = "identity"
+    return headers
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    Yield the payload of each SSE `data: ` line, framing the raw byte stream.
+    
+    Lines are split on bytes and only data lines are copied out, so there's no
+    per-line str decoding; orjson parses the payload bytes directly.
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes():
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b"\n", start)) != -1:
+            if buf.startswith(b"data: ", start, nl):
+                yield bytes(buf[start + 6:nl]).rstrip(b"\r")
+            start = nl + 1
+        del buf[:start]
+    # Final line without a trailing newline
+    if buf.startswith(b"data: "):
+        yield bytes(buf[6:]).rstrip(b"\r")
+
+
 async def stream_completion(
     messages: list[dict],
     config: dict,
@@ -97,85 +155,89 @@ async def stream_completion(
         "stream": True,
         **params
     }
+    # Serialized once; the same bytes are sent and logged
+    body_bytes = orjson.dumps(request_body)
     
     start_time = time.time()
-    full_response = ""
+    response_parts: list[str] = []
+    # "thinking" (Claude) or "reasoning_content" (DeepSeek), bound once the provider uses one
+    thinking_key = None
     status = "success"
     error_message = None
     
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream(
-                "POST",
-                f"{base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=request_body,
-                timeout=httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=10.0)  # Reasonable limits
-            ) as response:
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    status = "error"
-                    error_message = f"LLM API error {response.status_code}: {error_text.decode()}"
-                    raise Exception(error_message)
+    client = get_http_client()
+    try:
+        async with client.stream(
+            "POST",
+            f"{base_url}/chat/completions",
+            headers=_request_headers(api_key, True),
+            content=body_bytes,
+            timeout=STREAM_TIMEOUT
+        ) as response:
+            if response.status_code != 200:
+                error_text = await response.aread()
+                status = "error"
+                error_message = f"LLM API error {response.status_code}: {error_text.decode()}"
+                raise Exception(error_message)
+            
+            async for data in _iter_sse_data(response):
+                # Check abort flag
+                if session_id and should_abort(session_id):
+                    clear_abort(session_id)
+                    break
                 
-                async for line in response.aiter_lines():
-                    # Check abort flag
-                    if session_id and should_abort(session_id):
-                        clear_abort(session_id)
-                        break
-                    
-                    if not line:
-                        continue
-                    
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        
-                        if data == "[DONE]":
-                            break
+                if data == b"[DONE]":
+                    break
+                
+                try:
+                    delta = orjson.loads(data)["choices"][0]["delta"]
+                except (ValueError, KeyError, IndexError, TypeError):
+                    continue
+                if not delta:
+                    continue
+                
+                # Handle thinking/reasoning content (Claude, DeepSeek)
+                if thinking_key:
+                    thinking = delta.get(thinking_key)
+                elif thinking := delta.get("thinking"):
+                    thinking_key = "thinking"
+                elif thinking := delta.get("reasoning_content"):
+                    thinking_key = "reasoning_content"
+                if thinking:
+                    # Wrap thinking in <think> tags for frontend
+                    wrapped = "<think>" + thinking + "</think>"
+                    response_parts.append(wrapped)
+                    yield wrapped
+                
+                content = delta.get("content")
+                if content:
+                    response_parts.append(content)
+                    yield content
                         
-                        try:
-                            chunk = json.loads(data)
-                            if choices := chunk.get("choices"):
-                                choice = choices[0]
-                                if delta := choice.get("delta"):
-                                    # Handle thinking/reasoning content (Claude, DeepSeek)
-                                    thinking = delta.get("thinking") or delta.get("reasoning_content")
-                                    if thinking:
-                                        # Wrap thinking in <think> tags for frontend
-                                        full_response += f"<think>{thinking}</think>"
-                                        yield f"<think>{thinking}</think>"
-                                    
-                                    if content := delta.get("content"):
-                                        full_response += content
-                                        yield content
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except httpx.HTTPError as e:
-            status = "error"
-            error_message = f"HTTP error: {str(e)}"
-            raise Exception(error_message)
-        finally:
-            # Log the request
-            duration_ms = int((time.time() - start_time) * 1000)
-            try:
-                await log_request(
-                    request_type="chat",
-                    model=model,
-                    full_request=request_body,
-                    full_response={"content": full_response} if full_response else None,
-                    tokens_in=0,  # Would need to count from messages
-                    tokens_out=0,  # Would need to count response
-                    duration_ms=duration_ms,
-                    status=status,
-                    error_message=error_message
-                )
-            except Exception as log_err:
-                # Don't fail on logging errors, but make them visible
-                logger.warning("Failed to log request: %s", log_err)
+    except httpx.HTTPError as e:
+        status = "error"
+        error_message = f"HTTP error: {str(e)}"
+        raise Exception(error_message)
+    finally:
+        # Log the request
+        duration_ms = int((time.time() - start_time) * 1000)
+        full_response = "".join(response_parts)
+        try:
+            await log_request(
+                request_type="chat",
+                model=model,
+                full_request=request_body,
+                full_request_bytes=body_bytes,
+                full_response={"content": full_response} if full_response else None,
+                tokens_in=0,  # Would need to count from messages
+                tokens_out=0,  # Would need to count response
+                duration_ms=duration_ms,
+                status=status,
+                error_message=error_message
+            )
+        except Exception as log_err:
+            # Don't fail on logging errors, but make them visible
+            logger.warning("Failed to log request: %s", log_err)
 
 
 async def get_completion(
@@ -209,6 +271,7 @@ async def get_completion(
         "stream": False,
         **params
     }
+    body_bytes = orjson.dumps(request_body)
     
     start_time = time.time()
     status = "success"
@@ -216,48 +279,46 @@ async def get_completion(
     response_content = None
     response_data = None
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=request_body,
-                timeout=120.0
-            )
-            
-            if response.status_code != 200:
-                status = "error"
-                error_message = f"LLM API error {response.status_code}: {response.text}"
-                raise Exception(error_message)
-            
-            response_data = response.json()
-            response_content = response_data["choices"][0]["message"]["content"]
-            return response_content
-            
-        except httpx.HTTPError as e:
+    client = get_http_client()
+    try:
+        response = await client.post(
+            f"{base_url}/chat/completions",
+            headers=_request_headers(api_key, False),
+            content=body_bytes,
+            timeout=COMPLETION_TIMEOUT
+        )
+        
+        if response.status_code != 200:
             status = "error"
-            error_message = f"HTTP error: {str(e)}"
+            error_message = f"LLM API error {response.status_code}: {response.text}"
             raise Exception(error_message)
-            
-        finally:
-            # Log the request
-            duration_ms = int((time.time() - start_time) * 1000)
-            try:
-                await log_request(
-                    request_type="chat",
-                    model=model,
-                    full_request=request_body,
-                    full_response=response_data,
-                    tokens_in=response_data.get("usage", {}).get("prompt_tokens", 0) if response_data else 0,
-                    tokens_out=response_data.get("usage", {}).get("completion_tokens", 0) if response_data else 0,
-                    duration_ms=duration_ms,
-                    status=status,
-                    error_message=error_message
-                )
-            except Exception as log_err:
-                # Don't fail on logging errors, but make them visible
-                logger.warning("Failed to log request: %s", log_err)
+        
+        response_data = response.json()
+        response_content = response_data["choices"][0]["message"]["content"]
+        return response_content
+        
+    except httpx.HTTPError as e:
+        status = "error"
+        error_message = f"HTTP error: {str(e)}"
+        raise Exception(error_message)
+        
+    finally:
+        # Log the request
+        duration_ms = int((time.time() - start_time) * 1000)
+        try:
+            await log_request(
+                request_type="chat",
+                model=model,
+                full_request=request_body,
+                full_request_bytes=body_bytes,
+                full_response=response_data,
+                tokens_in=response_data.get("usage", {}).get("prompt_tokens", 0) if response_data else 0,
+                tokens_out=response_data.get("usage", {}).get("completion_tokens", 0) if response_data else 0,
+                duration_ms=duration_ms,
+                status=status,
+                error_message=error_message
+            )
+        except Exception as log_err:
+            # Don't fail on logging errors, but make them visible
+            logger.warning("Failed to log request: %s", log_err)
 
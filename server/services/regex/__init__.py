@@ -2,6 +2,7 @@
 Regex services.
 """
 from .processor import (
+    ScriptSet,
     apply_regex_scripts,
     get_regex_scripts,
     get_regex_scripts_by_ids,
@@ -11,6 +12,7 @@ from .processor import (
 )
 
 __all__ = [
+    "ScriptSet",
     "apply_regex_scripts",
     "get_regex_scripts",
     "get_regex_scripts_by_ids",
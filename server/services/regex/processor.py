@@ -3,39 +3,67 @@ Regex Processing Service - SillyTavern Compatible with Agent Stage Scope
 """
 import re
 import json
-import aiosqlite
+from functools import lru_cache
 from typing import Optional
 
-from models import DATABASE_PATH
+from models import acquire_db
 
 
-async def get_regex_scripts() -> list[dict]:
+class ScriptSet(list):
+    """
+    A fetched list of regex scripts with an id that changes whenever the rows do.
+    
+    The id covers each script's id, updated_at and position, so edits, toggles,
+    deletes and reorders all produce a new set and stale filter results are never reused.
+    """
+    
+    def __init__(self, scripts=()):
+        super().__init__(scripts)
+        self.id = hash(tuple((s.get("id"), s.get("updated_at"), s.get("order_index")) for s in self))
+
+
+async def get_regex_scripts() -> ScriptSet:
     """Get all enabled regex scripts ordered by order_index."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with acquire_db() as db:
         async with db.execute(
             "SELECT * FROM regex_scripts WHERE enabled = 1 ORDER BY order_index"
         ) as cursor:
             rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            return ScriptSet(dict(row) for row in rows)
+
+
+# IN-clause arity is rounded up to a power of two (padded with '', which is never
+# an ID) so the connection's statement cache only ever sees a few distinct queries
+_ids_stmt_cache: dict[int, str] = {}
+
 
+def _ids_statement(count: int) -> tuple[int, str]:
+    """Return (padded arity, SELECT ... IN (...) statement) for count IDs."""
+    arity = 1 << (count - 1).bit_length()
+    stmt = _ids_stmt_cache.get(arity)
+    if stmt is None:
+        placeholders = ",".join("?" * arity)
+        stmt = _ids_stmt_cache[arity] = (
+            f"SELECT * FROM regex_scripts WHERE enabled = 1 AND id IN ({placeholders})"
+        )
+    return arity, stmt
 
-async def get_regex_scripts_by_ids(script_ids: list[str]) -> list[dict]:
+
+async def get_regex_scripts_by_ids(script_ids: list[str]) -> ScriptSet:
     """Get regex scripts by specific IDs, preserving order."""
     if not script_ids:
-        return []
+        return ScriptSet()
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        placeholders = ",".join(["?" for _ in script_ids])
-        async with db.execute(
-            f"SELECT * FROM regex_scripts WHERE enabled = 1 AND id IN ({placeholders})",
-            script_ids
-        ) as cursor:
+    arity, stmt = _ids_statement(len(script_ids))
+    params = list(script_ids)
+    params += [""] * (arity - len(params))
+    
+    async with acquire_db() as db:
+        async with db.execute(stmt, params) as cursor:
             rows = await cursor.fetchall()
             scripts = {row["id"]: dict(row) for row in rows}
             # Return in requested order
-            return [scripts[sid] for sid in script_ids if sid in scripts]
+            return ScriptSet(script for script in map(scripts.get, script_ids) if script is not None)
 
 
 def expand_regex_macros(pattern: str, ctx: dict) -> str:
@@ -53,28 +81,213 @@ def expand_regex_macros(pattern: str, ctx: dict) -> str:
     if not ctx:
         return pattern
     
-    result = pattern
+    return _expand_regex_macros(
+        pattern,
+        ctx.get('user', 'User'),
+        ctx.get('char', ctx.get('character', '')),
+        ctx.get('persona', ''),
+        ctx.get('input', ''),
+    )
+
+
+_MACRO_RE = re.compile(r'\{\{(user|char|persona|input)\}\}', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _expand_regex_macros(pattern: str, user_name: str, char_name: str, persona: str, user_input: str) -> str:
+    """Cached macro expansion; the same pattern/context pair recurs on every chat turn."""
+    # {{user}} is always expanded; the others only when a value is present
+    values = {
+        "user": user_name,
+        "char": char_name,
+        "persona": persona,
+        "input": user_input,
+    }
+    
+    def expand(match_obj):
+        name = match_obj.group(1).lower()
+        value = values[name]
+        if not value and name != "user":
+            return match_obj.group(0)
+        return re.escape(value)
+    
+    return _MACRO_RE.sub(expand, pattern)
+
+
+@lru_cache(maxsize=512)
+def _compile(pattern: str, flags: int) -> re.Pattern:
+    """Compile a script pattern once; re's own cache is small and easily evicted."""
+    return re.compile(pattern, flags)
+
+
+# SillyTavern {{match}}/{{MATCH}} macros and $0-$9 group references
+_REPLACE_TOKEN_RE = re.compile(r'\{\{(?:match|MATCH)\}\}|\$(\d)')
+
+
+@lru_cache(maxsize=512)
+def _replacement_template(replace_with: str, group_count: int) -> str:
+    """
+    Rewrite a replace_with string into a native re.sub template.
+    
+    {{match}}, {{MATCH}} and $0 become \\g<0>, $N becomes \\g<N> when the pattern
+    has that group (otherwise it stays literal), and other backslashes are
+    escaped so the substitution runs entirely inside the C engine.
+    """
+    def to_group_ref(match_obj):
+        digit = match_obj.group(1)
+        if digit is None:
+            return r'\g<0>'
+        group = int(digit)
+        return rf'\g<{group}>' if group <= group_count else match_obj.group(0)
+    
+    template = replace_with.replace('\\', '\\\\')
+    if not _REPLACE_TOKEN_RE.search(template):
+        # Plain replacement text - nothing to rewrite
+        return template
+    return _REPLACE_TOKEN_RE.sub(to_group_ref, template)
+
+
+_REGEX_META = frozenset('.^$*+?{}[]\\|()')
+_MATCH_TOKEN_RE = re.compile(r'\{\{(?:match|MATCH)\}\}|\$0')
+
+
+def _batchable_literal(pattern: re.Pattern, count: int) -> Optional[str]:
+    """Return the pattern text if it is a global, group-free plain literal."""
+    text = pattern.pattern
+    if count or not text or _REGEX_META.intersection(text):
+        return None
+    if pattern.flags & re.IGNORECASE:
+        if not text.isascii():
+            return None
+        text = text.lower()
+    return text
+
+
+def _literals_overlap(a: str, b: str) -> bool:
+    """Whether matches of two literals could ever overlap in some text."""
+    if a in b or b in a:
+        return True
+    return any(a.endswith(b[:k]) or b.endswith(a[:k]) for k in range(1, min(len(a), len(b))))
+
+
+def _can_join(run: list, literal: str, flags: int) -> bool:
+    """
+    Whether a literal step can join a run while giving the same result as applying
+    the scripts one after another: no two patterns can overlap, and no earlier
+    replacement can contain or (by deleting text) create a match of the new one.
+    """
+    literal_chars = set(literal)
+    for prev_literal, prev_flags, prev_replace in run:
+        if prev_flags != flags or not prev_replace:
+            return False
+        if _literals_overlap(prev_literal, literal):
+            return False
+        replace_chars = prev_replace.lower() if flags & re.IGNORECASE else prev_replace
+        if literal_chars.intersection(replace_chars):
+            return False
+    return True
+
+
+def _combined_substitution(run: list) -> tuple:
+    """Build one alternation (and dispatching replacement) for a run of literal steps."""
+    flags = run[0][1]
+    combined = _compile("|".join(f"({re.escape(lit)})" for lit, _, _ in run), flags)
+    # Each replacement split on {{match}}/$0 so the matched text can be joined back in.
+    # Every alternative is exactly one group, so lastindex - 1 is the step index.
+    parts = [_MATCH_TOKEN_RE.split(replace_with) for _, _, replace_with in run]
+    if all(len(pieces) == 1 for pieces in parts):
+        replacements = [pieces[0] for pieces in parts]
+        return combined, lambda match_obj: replacements[match_obj.lastindex - 1], 0
+    
+    def dispatch(match_obj):
+        pieces = parts[match_obj.lastindex - 1]
+        return match_obj.group(0).join(pieces) if len(pieces) > 1 else pieces[0]
     
-    # User name
-    user_name = ctx.get('user', 'User')
-    result = re.sub(r'\{\{user\}\}', re.escape(user_name), result, flags=re.IGNORECASE)
+    return combined, dispatch, 0
+
+
+@lru_cache(maxsize=128)
+def _plan_substitutions(steps: tuple) -> tuple:
+    """
+    Turn ordered (pattern, flags, replace_with, count) steps into (pattern, repl, count) subs.
     
-    # Character name
-    char_name = ctx.get('char', ctx.get('character', ''))
-    if char_name:
-        result = re.sub(r'\{\{char\}\}', re.escape(char_name), result, flags=re.IGNORECASE)
+    Consecutive literal find/replace scripts that can't interact are merged into a
+    single alternation, so a long run of formatting scripts scans the text once.
+    Everything else runs one script at a time with a native replacement template.
+    """
+    subs = []
+    run = []
     
-    # Persona
-    persona = ctx.get('persona', '')
-    if persona:
-        result = re.sub(r'\{\{persona\}\}', re.escape(persona), result, flags=re.IGNORECASE)
+    def flush():
+        if len(run) > 1:
+            subs.append(_combined_substitution(run))
+        elif run:
+            literal, flags, replace_with = run[0]
+            pattern = _compile(re.escape(literal), flags)
+            subs.append((pattern, _replacement_template(replace_with, 0), 0))
+        run.clear()
     
-    # User input (not escaped, for advanced users who want to match against it)
-    user_input = ctx.get('input', '')
-    if user_input:
-        result = re.sub(r'\{\{input\}\}', re.escape(user_input), result, flags=re.IGNORECASE)
+    for find_pattern, flags, replace_with, count in steps:
+        pattern = _compile(find_pattern, flags)
+        literal = _batchable_literal(pattern, count)
+        if literal is not None:
+            if run and not _can_join(run, literal, flags):
+                flush()
+            run.append((literal, flags, replace_with))
+            continue
+        flush()
+        subs.append((pattern, _replacement_template(replace_with, pattern.groups), count))
+    flush()
     
-    return result
+    return tuple(subs)
+
+
+def _script_applies(script: dict, message_role: str, target: str, agent_stage: Optional[str]) -> bool:
+    """Role/stage and target filters; these don't depend on the message itself."""
+    # Check if script applies to this agent stage
+    if agent_stage:
+        if agent_stage == "director":
+            if not script.get("run_on_director_output", 0):
+                return False
+        elif agent_stage == "writer":
+            if not script.get("run_on_writer_output", 1):
+                return False
+        elif agent_stage == "paint_director":
+            if not script.get("run_on_paint_director_output", 0):
+                return False
+    else:
+        # Normal chat mode - check run_on_ai_output/run_on_user_input
+        if message_role == "user" and not script.get("run_on_user_input", 0):
+            return False
+        if message_role == "assistant" and not script.get("run_on_ai_output", 1):
+            return False
+    
+    # Check if script applies to this target (display vs prompt)
+    # Handle both old and new column names for backwards compatibility
+    if target == "display":
+        return bool(script.get("only_format_display", script.get("affect_display", 1)))
+    if target == "prompt":
+        return bool(script.get("only_format_prompt", script.get("affect_prompt", 0)))
+    return True
+
+
+FILTER_CACHE_SIZE = 64
+_filtered_cache: dict[tuple, tuple] = {}
+
+
+def _applicable_scripts(scripts: list[dict], message_role: str, target: str, agent_stage: Optional[str]) -> tuple:
+    """Scripts passing the role/stage and target filters, cached per ScriptSet."""
+    if not isinstance(scripts, ScriptSet):
+        return tuple(s for s in scripts if _script_applies(s, message_role, target, agent_stage))
+    
+    key = (scripts.id, message_role, target, agent_stage)
+    filtered = _filtered_cache.get(key)
+    if filtered is None:
+        filtered = tuple(s for s in scripts if _script_applies(s, message_role, target, agent_stage))
+        if len(_filtered_cache) >= FILTER_CACHE_SIZE:
+            _filtered_cache.pop(next(iter(_filtered_cache)))
+        _filtered_cache[key] = filtered
+    return filtered
 
 
 def apply_regex_scripts(
@@ -102,37 +315,9 @@ def apply_regex_scripts(
         Processed text
     """
     result = text
+    steps = []
     
-    for script in scripts:
-        # Check if script applies to this agent stage
-        if agent_stage:
-            if agent_stage == "director":
-                if not script.get("run_on_director_output", 0):
-                    continue
-            elif agent_stage == "writer":
-                if not script.get("run_on_writer_output", 1):
-                    continue
-            elif agent_stage == "paint_director":
-                if not script.get("run_on_paint_director_output", 0):
-                    continue
-        else:
-            # Normal chat mode - check run_on_ai_output/run_on_user_input
-            if message_role == "user" and not script.get("run_on_user_input", 0):
-                continue
-            if message_role == "assistant" and not script.get("run_on_ai_output", 1):
-                continue
-        
-        # Check if script applies to this target (display vs prompt)
-        # Handle both old and new column names for backwards compatibility
-        if target == "display":
-            applies = script.get("only_format_display", script.get("affect_display", 1))
-            if not applies:
-                continue
-        elif target == "prompt":
-            applies = script.get("only_format_prompt", script.get("affect_prompt", 0))
-            if not applies:
-                continue
-        
+    for script in _applicable_scripts(scripts, message_role, target, agent_stage):
         # Check depth constraints (only for non-agent-stage processing)
         if not agent_stage:
             min_depth = script.get("min_depth", 0) or 0
@@ -163,35 +348,17 @@ def apply_regex_scripts(
             if macro_context:
                 find_pattern = expand_regex_macros(find_pattern, macro_context)
             
-            pattern = re.compile(find_pattern, regex_flags)
-            replace_with = script.get("replace_with", "") or ""
-            
-            # SillyTavern {{match}} macro support - replaced during substitution
-            # Also support standard regex group references: $1, $2, etc.
-            def make_replacement(match_obj):
-                replaced = replace_with
-                # Replace {{match}} with the full matched text
-                replaced = replaced.replace("{{match}}", match_obj.group(0))
-                replaced = replaced.replace("{{MATCH}}", match_obj.group(0))
-                # Replace $0 with full match
-                replaced = replaced.replace("$0", match_obj.group(0))
-                # Replace $1, $2, etc. with capture groups
-                for i in range(1, min(10, len(match_obj.groups()) + 1)):
-                    try:
-                        group_value = match_obj.group(i) or ""
-                        replaced = replaced.replace(f"${i}", group_value)
-                    except IndexError:
-                        break
-                return replaced
-            
-            if 'g' in flags_str:
-                result = pattern.sub(make_replacement, result)
-            else:
-                result = pattern.sub(make_replacement, result, count=1)
+            _compile(find_pattern, regex_flags)
         except re.error as e:
             # Log and skip invalid regex
             print(f"[Regex] Invalid regex '{script.get('name', 'Unknown')}': {e}")
             continue
+        
+        replace_with = script.get("replace_with", "") or ""
+        steps.append((find_pattern, regex_flags, replace_with, 0 if 'g' in flags_str else 1))
+    
+    for pattern, repl, count in _plan_substitutions(tuple(steps)):
+        result = pattern.sub(repl, result, count=count)
     
     return result
 
@@ -0,0 +1,120 @@
+"""
+Session Store - Chat session files and their append-only message logs
+"""
+import asyncio
+import weakref
+from typing import Optional
+
+from config import settings
+from utils import save_json_atomic, load_json, append_json_lines, load_json_lines
+
+
+def get_session_path(session_id: str):
+    return settings.data_dir / "chats" / f"{session_id}.json"
+
+
+def get_session_log_path(session_id: str):
+    return settings.data_dir / "chats" / f"{session_id}.jsonl"
+
+
+# Sessions keep metadata in {id}.json and new messages in an append-only
+# {id}.jsonl log, so a turn only writes its own messages. The log is folded
+# back into the JSON file once it grows past this size.
+SESSION_LOG_COMPACT_BYTES = 256 * 1024
+
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _get_session_lock(session_id: str) -> asyncio.Lock:
+    """Get the lock serializing writes to a session's files."""
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+async def _merge_session_log(session_id: str, data: dict) -> dict:
+    """Apply messages appended since the last compaction to session data."""
+    logged = await load_json_lines(get_session_log_path(session_id))
+    if logged:
+        messages = data.setdefault("messages", [])
+        # A crash between a compaction's save and its log unlink leaves entries
+        # that are already in the session file; skip those by message ID
+        saved_ids = {m.get("id") for m in messages}
+        messages.extend(m for m in logged if m.get("id") is None or m["id"] not in saved_ids)
+        last_timestamp = logged[-1].get("timestamp")
+        if last_timestamp and last_timestamp > data.get("updated_at", ""):
+            data["updated_at"] = last_timestamp
+    return data
+
+
+async def _read_session(session_id: str) -> Optional[dict]:
+    data = await load_json(get_session_path(session_id))
+    if data:
+        await _merge_session_log(session_id, data)
+    return data
+
+
+async def _compact_session(session_id: str):
+    data = await _read_session(session_id)
+    if data:
+        await save_json_atomic(get_session_path(session_id), data)
+    get_session_log_path(session_id).unlink(missing_ok=True)
+
+
+async def load_session_data(session_id: str) -> Optional[dict]:
+    """Load a session file together with its pending message log."""
+    async with _get_session_lock(session_id):
+        return await _read_session(session_id)
+
+
+async def merge_session_logs(sessions: list[dict]) -> list[dict]:
+    """
+    Bring listed session data up to date with any pending message logs.
+    
+    The chats directory is globbed once, and only sessions that have a log are
+    re-read, concurrently and each under its own lock.
+    """
+    logged_ids = {path.stem for path in (settings.data_dir / "chats").glob("*.jsonl")}
+    pending = [i for i, s in enumerate(sessions) if s.get("id") in logged_ids]
+    if not pending:
+        return sessions
+    fresh = await asyncio.gather(*(load_session_data(sessions[i]["id"]) for i in pending))
+    for i, data in zip(pending, fresh):
+        sessions[i] = data
+    return [s for s in sessions if s]
+
+
+async def save_session_data(session_id: str, data: dict):
+    """Rewrite the full session file, discarding the pending message log."""
+    async with _get_session_lock(session_id):
+        await save_json_atomic(get_session_path(session_id), data)
+        get_session_log_path(session_id).unlink(missing_ok=True)
+
+
+async def delete_session_files(session_id: str) -> bool:
+    """Delete a session file and its message log. Returns False if it doesn't exist."""
+    async with _get_session_lock(session_id):
+        path = get_session_path(session_id)
+        if not path.exists():
+            return False
+        path.unlink()
+        get_session_log_path(session_id).unlink(missing_ok=True)
+        return True
+
+
+async def append_session_messages(session_id: str, messages: list[dict]):
+    """Append messages to a session's log, compacting it when it gets large."""
+    async with _get_session_lock(session_id):
+        log_size = await append_json_lines(get_session_log_path(session_id), messages)
+        if log_size >= SESSION_LOG_COMPACT_BYTES:
+            await _compact_session(session_id)
+
+
+async def compact_session_logs():
+    """Fold every pending session message log into its session file."""
+    for log_path in (settings.data_dir / "chats").glob("*.jsonl"):
+        session_id = log_path.stem
+        async with _get_session_lock(session_id):
+            await _compact_session(session_id)
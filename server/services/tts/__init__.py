@@ -1,6 +1,6 @@
 """
 TTS services.
 """
-from .synthesizer import synthesize_speech, get_tts_config, get_available_voices
+from .synthesizer import synthesize_speech, get_tts_config, get_available_voices, invalidate_tts_config_cache
 
-__all__ = ["synthesize_speech", "get_tts_config", "get_available_voices"]
+__all__ = ["synthesize_speech", "get_tts_config", "get_available_voices", "invalidate_tts_config_cache"]
@@ -2,19 +2,42 @@
 TTS Synthesis Service
 """
 import httpx
-import aiosqlite
-import re
+import time
+from functools import lru_cache
 from typing import Optional
 
-from models import DATABASE_PATH
-from utils import decrypt_api_key, save_audio, generate_id
+from models import acquire_db
+from utils import decrypt_api_key_async, save_audio, generate_id, get_http_client
+
+
+SYNTHESIS_TIMEOUT = httpx.Timeout(60.0)
+VOICES_TIMEOUT = httpx.Timeout(30.0)
+
+
+# Decrypted configs, cached briefly (keyed by config ID, None = active config)
+CONFIG_CACHE_TTL = 30.0
+_config_cache: dict[Optional[str], tuple[float, dict]] = {}
+
+
+def invalidate_tts_config_cache():
+    """Drop cached TTS configs. Call after any write to tts_configs."""
+    _config_cache.clear()
 
 
 async def get_tts_config(config_id: Optional[str] = None) -> Optional[dict]:
     """Get TTS configuration by ID or get active config."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
+    cached = _config_cache.get(config_id)
+    if cached and time.monotonic() - cached[0] < CONFIG_CACHE_TTL:
+        return cached[1]
+    
+    config = await _load_tts_config(config_id)
+    if config:
+        _config_cache[config_id] = (time.monotonic(), config)
+    return config
+
+
+async def _load_tts_config(config_id: Optional[str]) -> Optional[dict]:
+    async with acquire_db() as db:
         if config_id:
             query = "SELECT * FROM tts_configs WHERE id = ?"
             params = (config_id,)
@@ -30,7 +53,7 @@ async def get_tts_config(config_id: Optional[str] = None) -> Optional[dict]:
             return {
                 "id": row["id"],
                 "type": row["type"],
-                "api_key": decrypt_api_key(row["api_key_encrypted"]),
+                "api_key": await decrypt_api_key_async(row["api_key_encrypted"]),
                 "default_voice_id": row["default_voice_id"],
                 # Extended parameters (with fallbacks)
                 "model_id": row["model_id"] if "model_id" in row.keys() else "",
@@ -43,7 +66,7 @@ async def get_tts_config(config_id: Optional[str] = None) -> Optional[dict]:
 
 async def get_voice_for_character(config_id: str, character_name: str) -> Optional[str]:
     """Get the voice ID for a specific character."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with acquire_db() as db:
         async with db.execute(
             "SELECT voice_id FROM character_voices WHERE tts_config_id = ? AND character_name = ?",
             (config_id, character_name)
@@ -52,6 +75,10 @@ async def get_voice_for_character(config_id: str, character_name: str) -> Option
             return row[0] if row else None
 
 
+# Wrap pattern -> (prefix, suffix); None when {text} appears more than once
+_wrap_cache: dict[str, Optional[tuple[str, str]]] = {}
+
+
 def apply_dialogue_wrap(text: str, pattern: str) -> str:
     """
     Apply dialogue wrapping pattern to text before synthesis.
@@ -62,9 +89,24 @@ def apply_dialogue_wrap(text: str, pattern: str) -> str:
     - "「{text}」" - Japanese quotes
     - "*{text}*" - Emphasis markers
     """
-    if not pattern or "{text}" not in pattern:
+    if not pattern:
         return text
-    return pattern.replace("{text}", text)
+    
+    try:
+        parts = _wrap_cache[pattern]
+    except KeyError:
+        count = pattern.count("{text}")
+        if count == 0:
+            parts = ("", "")
+        elif count == 1:
+            parts = tuple(pattern.split("{text}", 1))
+        else:
+            parts = None
+        _wrap_cache[pattern] = parts
+    
+    if parts is None:
+        return pattern.replace("{text}", text)
+    return parts[0] + text + parts[1]
 
 
 async def synthesize_speech(
@@ -106,12 +148,21 @@ async def synthesize_speech(
     if not voice_id:
         raise Exception("No voice ID specified or configured")
     
-    if config["type"] == "elevenlabs":
-        return await synthesize_elevenlabs(text, voice_id, chat_session_id, config)
-    elif config["type"] == "openai":
-        return await synthesize_openai(text, voice_id, chat_session_id, config)
-    else:
+    synthesize = _SYNTHESIZERS.get(config["type"])
+    if synthesize is None:
         raise Exception(f"Unknown TTS type: {config['type']}")
+    return await synthesize(text, voice_id, chat_session_id, config)
+
+
+# Request headers per API key; built once and shared, httpx copies them per request
+@lru_cache(maxsize=16)
+def _elevenlabs_headers(api_key: str) -> dict:
+    return {"xi-api-key": api_key, "Content-Type": "application/json"}
+
+
+@lru_cache(maxsize=16)
+def _openai_headers(api_key: str) -> dict:
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
 
 
 async def synthesize_elevenlabs(
@@ -128,31 +179,28 @@ async def synthesize_elevenlabs(
     stability = config.get("stability", 0.5)
     similarity_boost = config.get("similarity_boost", 0.75)
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-            headers={
-                "xi-api-key": api_key,
-                "Content-Type": "application/json",
-            },
-            json={
-                "text": text,
-                "model_id": model_id,
-                "voice_settings": {
-                    "stability": stability,
-                    "similarity_boost": similarity_boost,
-                }
-            },
-            timeout=60.0
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"ElevenLabs API error: {response.text}")
-        
-        audio_data = response.content
-        filename = f"{generate_id()}.mp3"
-        audio_url = await save_audio(audio_data, chat_session_id, filename)
-        return audio_url
+    client = get_http_client()
+    response = await client.post(
+        f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+        headers=_elevenlabs_headers(api_key),
+        json={
+            "text": text,
+            "model_id": model_id,
+            "voice_settings": {
+                "stability": stability,
+                "similarity_boost": similarity_boost,
+            }
+        },
+        timeout=SYNTHESIS_TIMEOUT
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"ElevenLabs API error: {response.text}")
+    
+    audio_data = response.content
+    filename = f"{generate_id()}.mp3"
+    audio_url = await save_audio(audio_data, chat_session_id, filename)
+    return audio_url
 
 
 async def synthesize_openai(
@@ -171,59 +219,75 @@ async def synthesize_openai(
     # Clamp speed to OpenAI limits
     speed = max(0.25, min(4.0, speed))
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://api.openai.com/v1/audio/speech",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": model,
-                "input": text,
-                "voice": voice_id,  # alloy, echo, fable, onyx, nova, shimmer
-                "speed": speed,
-            },
-            timeout=60.0
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"OpenAI TTS API error: {response.text}")
-        
-        audio_data = response.content
-        filename = f"{generate_id()}.mp3"
-        audio_url = await save_audio(audio_data, chat_session_id, filename)
-        return audio_url
+    client = get_http_client()
+    response = await client.post(
+        "https://api.openai.com/v1/audio/speech",
+        headers=_openai_headers(api_key),
+        json={
+            "model": model,
+            "input": text,
+            "voice": voice_id,  # alloy, echo, fable, onyx, nova, shimmer
+            "speed": speed,
+        },
+        timeout=SYNTHESIS_TIMEOUT
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"OpenAI TTS API error: {response.text}")
+    
+    audio_data = response.content
+    filename = f"{generate_id()}.mp3"
+    audio_url = await save_audio(audio_data, chat_session_id, filename)
+    return audio_url
+
+
+# Synthesizers by config type
+_SYNTHESIZERS = {
+    "elevenlabs": synthesize_elevenlabs,
+    "openai": synthesize_openai,
+}
+
+# OpenAI has fixed voices
+_OPENAI_VOICES = (
+    {"id": "alloy", "name": "Alloy"},
+    {"id": "echo", "name": "Echo"},
+    {"id": "fable", "name": "Fable"},
+    {"id": "onyx", "name": "Onyx"},
+    {"id": "nova", "name": "Nova"},
+    {"id": "shimmer", "name": "Shimmer"},
+)
+
+
+async def _elevenlabs_voices(api_key: str) -> list[dict]:
+    client = get_http_client()
+    response = await client.get(
+        "https://api.elevenlabs.io/v1/voices",
+        headers=_elevenlabs_headers(api_key),
+        timeout=VOICES_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch voices: {response.text}")
+    
+    data = response.json()
+    return [
+        {"id": v["voice_id"], "name": v["name"], "preview_url": v.get("preview_url")}
+        for v in data.get("voices", [])
+    ]
+
+
+async def _openai_voices(api_key: str) -> list[dict]:
+    return list(_OPENAI_VOICES)
+
+
+_VOICE_LISTERS = {
+    "elevenlabs": _elevenlabs_voices,
+    "openai": _openai_voices,
+}
 
 
 async def get_available_voices(type: str, api_key: str) -> list[dict]:
     """Fetch available voices from the TTS provider."""
-    if type == "elevenlabs":
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.elevenlabs.io/v1/voices",
-                headers={"xi-api-key": api_key},
-                timeout=30.0
-            )
-            if response.status_code != 200:
-                raise Exception(f"Failed to fetch voices: {response.text}")
-            
-            data = response.json()
-            return [
-                {"id": v["voice_id"], "name": v["name"], "preview_url": v.get("preview_url")}
-                for v in data.get("voices", [])
-            ]
-    
-    elif type == "openai":
-        # OpenAI has fixed voices
-        return [
-            {"id": "alloy", "name": "Alloy"},
-            {"id": "echo", "name": "Echo"},
-            {"id": "fable", "name": "Fable"},
-            {"id": "onyx", "name": "Onyx"},
-            {"id": "nova", "name": "Nova"},
-            {"id": "shimmer", "name": "Shimmer"},
-        ]
-    
-    else:
+    list_voices = _VOICE_LISTERS.get(type)
+    if list_voices is None:
         return []
+    return await list_voices(api_key)
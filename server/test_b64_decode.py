@@ -0,0 +1,41 @@
+import base64
+import os
+
+import orjson
+
+from services.image.generator import B64_CHUNK_SIZE, _find_b64_field, _iter_b64_decode
+
+
+def decode_field(content: bytes, field: str) -> bytes:
+    # Same fast path / fallback as the OpenAI-compatible provider
+    image_b64 = _find_b64_field(content, field)
+    if image_b64 is None:
+        image_b64 = orjson.loads(content)[field]
+    return b"".join(_iter_b64_decode(image_b64))
+
+
+def test_plain_payload():
+    image = os.urandom(3 * B64_CHUNK_SIZE)
+    content = orjson.dumps({"b64_json": base64.b64encode(image).decode()})
+    assert decode_field(content, "b64_json") == image
+
+
+def test_escaped_slash_payload():
+    image = os.urandom(3 * B64_CHUNK_SIZE)
+    content = orjson.dumps({"b64_json": base64.b64encode(image).decode()}).replace(b"/", b"\\/")
+    assert decode_field(content, "b64_json") == image
+
+
+def test_line_wrapped_payload():
+    # base64.encodebytes wraps every 76 chars; JSON carries the breaks as \n escapes
+    image = os.urandom(3 * B64_CHUNK_SIZE)
+    content = orjson.dumps({"b64_json": base64.encodebytes(image).decode()})
+    assert _find_b64_field(content, "b64_json") is None
+    assert decode_field(content, "b64_json") == image
+
+
+if __name__ == "__main__":
+    test_plain_payload()
+    test_escaped_slash_payload()
+    test_line_wrapped_payload()
+    print("ok")
@@ -24,35 +24,35 @@ async def test():
     else:
         print(f"  ✗ Port 8055 is CLOSED (error code: {result})")
         
-    # Try different URLs
-    print("\n[2] Testing HTTP connections...")
-    for url in urls_to_try:
-        print(f"\n  Testing {url}...")
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{url}/system_stats", timeout=5.0)
+    # One client (and connection pool) shared by every probe
+    async with httpx.AsyncClient(timeout=5.0, limits=httpx.Limits(max_keepalive_connections=1)) as client:
+        # Try different URLs
+        print("\n[2] Testing HTTP connections...")
+        for url in urls_to_try:
+            print(f"\n  Testing {url}...")
+            try:
+                response = await client.get(f"{url}/system_stats")
                 print(f"    Status: {response.status_code}")
                 if response.status_code == 200:
                     data = response.json()
                     print(f"    ✓ ComfyUI connected!")
                     print(f"    VRAM: {data.get('system', {}).get('vram', {})}")
                     return url
-        except httpx.ConnectError as e:
-            print(f"    ✗ Connect failed: {e}")
-        except httpx.ReadTimeout:
-            print(f"    ✗ Read timeout")
-        except Exception as e:
-            print(f"    ✗ Error: {type(e).__name__}: {e}")
-    
-    print("\n[3] No connection worked. Checking with simple HTTP request...")
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("http://127.0.0.1:8055/", timeout=5.0)
+            except httpx.ConnectError as e:
+                print(f"    ✗ Connect failed: {e}")
+            except httpx.ReadTimeout:
+                print(f"    ✗ Read timeout")
+            except Exception as e:
+                print(f"    ✗ Error: {type(e).__name__}: {e}")
+        
+        print("\n[3] No connection worked. Checking with simple HTTP request...")
+        try:
+            response = await client.get("http://127.0.0.1:8055/")
             print(f"  Root URL status: {response.status_code}")
             print(f"  Content type: {response.headers.get('content-type')}")
             print(f"  First 200 chars: {response.text[:200]}")
-    except Exception as e:
-        print(f"  Error: {e}")
+        except Exception as e:
+            print(f"  Error: {e}")
     
     return None
 
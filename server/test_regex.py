@@ -1,5 +1,10 @@
 import re
 
+# Compiled once up front; the sub() calls below reuse them
+# Lazy: stops at the first closing tag instead of running to the end and backtracking
+UPDATE_RE = re.compile(r'<update>.*?</update>', re.DOTALL)
+UPDATE_DOTALL_RE = re.compile(r'<update>.*</update>', re.DOTALL)
+
 text = """<update>
 <update_analysis>
 content here
@@ -7,14 +12,12 @@ content here
 _.set('test', 'value');
 </update>"""
 
-# Test with raw string pattern
-pattern = r'<update>[\s\S]*</update>'
-result = re.sub(pattern, '', text, flags=re.DOTALL)
+# Test with lazy DOTALL pattern
+result = UPDATE_RE.sub('', text)
 print(f'Input len: {len(text)}, Output len: {len(result)}')
 print('Result:', repr(result))
 
 # Test with 's' flag (DOTALL) using .* instead
-pattern2 = r'<update>.*</update>'
-result2 = re.sub(pattern2, '', text, flags=re.DOTALL)
+result2 = UPDATE_DOTALL_RE.sub('', text)
 print(f'With .* and DOTALL: {len(result2)}')
 print('Result2:', repr(result2))
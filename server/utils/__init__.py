@@ -1,19 +1,56 @@
 """
 Utils package initialization.
 """
-from .encryption import encrypt_api_key, decrypt_api_key
-from .file_helper import save_json, load_json, list_json_files, generate_id, save_image, save_audio
+from importlib import import_module
+
+from .http_client import get_http_client, close_http_client
 from .logging_config import logger, get_logger, log_info, log_debug, log_warning, log_error, log_exception
 
+# Imported on first use (PEP 562): encryption pulls in cryptography/OpenSSL and
+# file_helper pulls in aiofiles/orjson, which scripts that only log never need
+_LAZY_ATTRS = {
+    **dict.fromkeys(
+        ("encrypt_api_key", "decrypt_api_key", "encrypt_api_key_async", "decrypt_api_key_async",
+         "decrypt_api_keys_async"),
+        ".encryption",
+    ),
+    **dict.fromkeys(
+        ("save_json", "save_json_atomic", "load_json", "load_json_many", "append_json_lines",
+         "load_json_lines", "list_json_files", "generate_id", "save_image", "save_image_stream",
+         "save_audio"),
+        ".file_helper",
+    ),
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
 __all__ = [
     "encrypt_api_key",
     "decrypt_api_key", 
+    "encrypt_api_key_async",
+    "decrypt_api_key_async",
+    "decrypt_api_keys_async",
     "save_json",
+    "save_json_atomic",
     "load_json",
+    "load_json_many",
+    "append_json_lines",
+    "load_json_lines",
     "list_json_files",
     "generate_id",
     "save_image",
+    "save_image_stream",
     "save_audio",
+    # HTTP
+    "get_http_client",
+    "close_http_client",
     # Logging
     "logger",
     "get_logger",
@@ -3,61 +3,135 @@ Encryption utilities for secure API key storage.
 """
 import os
 import base64
+import asyncio
+import hashlib
+import hmac
+import ssl
+import threading
 from pathlib import Path
+from typing import Optional
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 from config import settings
 
 
+# Passphrase-derived key cache: "<salt hex> <hmac(passphrase, salt + fernet key) hex> <fernet key>"
+DERIVED_KEY_FILE = ".encryption_key_derived"
+
+# The cipher is first built from to_thread workers; the lock keeps concurrent
+# first calls from each deriving (or generating) their own key
+_cipher: Optional[Fernet] = None
+_cipher_lock = threading.Lock()
+
+
+def _derived_key_check(passphrase: str, salt: bytes, key: bytes) -> str:
+    return hmac.new(passphrase.encode(), salt + key, hashlib.sha256).hexdigest()
+
+
+def _load_derived_key(path: Path, passphrase: str) -> Optional[bytes]:
+    """Return the cached derived key if it was derived from this passphrase."""
+    try:
+        salt_hex, check, key = path.read_text().split()
+        salt = bytes.fromhex(salt_hex)
+    except (OSError, ValueError):
+        return None
+    key_bytes = key.encode()
+    if not hmac.compare_digest(check, _derived_key_check(passphrase, salt, key_bytes)):
+        return None  # Passphrase was rotated (or the file was altered)
+    return key_bytes
+
+
+def _store_derived_key(path: Path, passphrase: str, key: bytes):
+    """Write the derived key cache atomically (exclusive temp file, then rename)."""
+    salt = os.urandom(16)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{salt.hex()} {_derived_key_check(passphrase, salt, key)} {key.decode()}\n")
+        os.replace(tmp, path)
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
+        print(f"[WARN] Could not cache derived encryption key: {e}")
+
+
+def _pbkdf2(password: bytes, salt: bytes, iterations: int, key_len: int = 32) -> bytes:
+    """
+    PBKDF2-HMAC-SHA256.
+    
+    A Fernet key is 32 bytes, exactly one SHA-256 output block, so there is nothing
+    to split across threads - each block still needs its full iteration chain.
+    hashlib can't compute blocks individually; longer keys are derived block after
+    block inside the same OpenSSL call (with the GIL released).
+    """
+    return hashlib.pbkdf2_hmac("sha256", password, salt, iterations, dklen=key_len)
+
+
 def _get_cipher() -> Fernet:
-    """Get or create encryption cipher."""
+    """Get or create the encryption cipher (built once per process)."""
+    global _cipher
+    if _cipher is None:
+        with _cipher_lock:
+            if _cipher is None:
+                _cipher = _build_cipher()
+    return _cipher
+
+
+def _build_cipher() -> Fernet:
     key = settings.encryption_key
     key_file = settings.data_dir / ".encryption_key"
     
+    # The key stays as bytes from wherever it comes from straight into Fernet
     if key is None:
         # Try to load existing key from file
         if key_file.exists():
-            key = key_file.read_text().strip()
+            key_bytes = key_file.read_bytes().strip()
         else:
             # Generate and save a new key
-            key = Fernet.generate_key().decode()
-            key_file.write_text(key)
+            key_bytes = Fernet.generate_key()
+            key_file.write_bytes(key_bytes)
             print(f"[INFO] Generated new encryption key and saved to {key_file}")
+    elif len(key) == 44:  # Fernet keys are 44 chars base64
+        key_bytes = key.encode()
     else:
-        # If key is a passphrase, derive a proper key from it
-        if len(key) != 44:  # Fernet keys are 44 chars base64
+        # Key is a passphrase, derive a proper key from it
+        derived_file = settings.data_dir / DERIVED_KEY_FILE
+        key_bytes = _load_derived_key(derived_file, key)
+        if key_bytes is None:
+            print(f"[INFO] Deriving encryption key from passphrase ({ssl.OPENSSL_VERSION})")
             salt = b"deeprp_salt_v1"  # Fixed salt for reproducibility
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=salt,
-                iterations=480000,
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(key.encode())).decode()
+            key_bytes = base64.urlsafe_b64encode(_pbkdf2(key.encode(), salt, 480000))
+            _store_derived_key(derived_file, key, key_bytes)
     
-    return Fernet(key.encode())
-
-
-_cipher = None
-
-
-def get_cipher() -> Fernet:
-    """Get cached cipher instance."""
-    global _cipher
-    if _cipher is None:
-        _cipher = _get_cipher()
-    return _cipher
+    return Fernet(key_bytes)
 
 
 def encrypt_api_key(api_key: str) -> str:
     """Encrypt an API key for storage."""
-    cipher = get_cipher()
-    return cipher.encrypt(api_key.encode()).decode()
+    return _get_cipher().encrypt(api_key.encode()).decode()
 
 
 def decrypt_api_key(encrypted_key: str) -> str:
     """Decrypt an API key from storage."""
-    cipher = get_cipher()
-    return cipher.decrypt(encrypted_key.encode()).decode()
+    return _get_cipher().decrypt(encrypted_key.encode()).decode()
+
+
+# Async variants for request handlers: the first call may build the cipher (file
+# I/O or a full PBKDF2 derivation), which must not stall the event loop
+async def encrypt_api_key_async(api_key: str) -> str:
+    """Encrypt an API key in a worker thread."""
+    return await asyncio.to_thread(encrypt_api_key, api_key)
+
+
+async def decrypt_api_key_async(encrypted_key: str) -> str:
+    """Decrypt an API key in a worker thread."""
+    return await asyncio.to_thread(decrypt_api_key, encrypted_key)
+
+
+def _decrypt_api_keys(encrypted_keys: list[str]) -> list[str]:
+    return [decrypt_api_key(encrypted_key) for encrypted_key in encrypted_keys]
+
+
+async def decrypt_api_keys_async(encrypted_keys: list[str]) -> list[str]:
+    """Decrypt several API keys in a single worker thread."""
+    return await asyncio.to_thread(_decrypt_api_keys, encrypted_keys)
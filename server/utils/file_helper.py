@@ -2,29 +2,129 @@
 File helper utilities.
 """
 import os
-import uuid
-import json
+import secrets
+import asyncio
 import aiofiles
+import orjson
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterable, Iterable, Union
 
 from config import settings
+from .logging_config import get_logger
+
+_log = get_logger(__name__)
+
+
+JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
 
 
 async def save_json(path: Path, data: Any) -> None:
     """Save data to a JSON file."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    async with aiofiles.open(path, 'w', encoding='utf-8') as f:
-        await f.write(json.dumps(data, indent=2, ensure_ascii=False))
+    await asyncio.to_thread(path.write_bytes, orjson.dumps(data, option=JSON_OPTIONS))
+
+
+async def save_json_atomic(path: Path, data: Any) -> None:
+    """
+    Save data to a JSON file without blocking the event loop.
+    
+    Encoding runs in a worker thread and the payload is written to a
+    temporary file that atomically replaces the target, so readers never
+    observe a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = await asyncio.to_thread(orjson.dumps, data, option=JSON_OPTIONS)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    await asyncio.to_thread(tmp_path.write_bytes, payload)
+    os.replace(tmp_path, path)
 
 
 async def load_json(path: Path) -> Any:
     """Load data from a JSON file."""
     if not path.exists():
         return None
-    async with aiofiles.open(path, 'r', encoding='utf-8') as f:
-        content = await f.read()
-        return json.loads(content)
+    # One thread hop for the whole read; orjson parses the bytes directly
+    return orjson.loads(await asyncio.to_thread(path.read_bytes))
+
+
+def _append_bytes(path: Path, payload: bytes) -> int:
+    with open(path, "a+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            # Start on a fresh line if the previous append was torn by a crash
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                payload = b"\n" + payload
+        f.write(payload)
+    return end + len(payload)
+
+
+async def append_json_lines(path: Path, items: list[Any]) -> int:
+    """
+    Append items to a newline-delimited JSON log.
+    
+    Returns the size of the log file in bytes after the append.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = b"".join(orjson.dumps(item) + b"\n" for item in items)
+    return await asyncio.to_thread(_append_bytes, path, payload)
+
+
+async def load_json_lines(path: Path) -> list[Any]:
+    """
+    Load all records from a newline-delimited JSON log.
+    
+    A line that doesn't parse (an append torn by a crash) is skipped and logged;
+    the next compaction drops it from disk.
+    """
+    try:
+        content = await asyncio.to_thread(path.read_bytes)
+    except FileNotFoundError:
+        return []
+    items = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            _log.warning("Skipping unreadable line in %s (%d bytes)", path.name, len(line))
+    return items
+
+
+# Concurrent read batches per load_json_many call; stays under the default thread pool size
+LIST_READ_CONCURRENCY = 16
+
+
+def _read_json_batch(paths: list[Path]) -> list[Any]:
+    items = []
+    for path in paths:
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            items.append(None)
+            continue
+        items.append(orjson.loads(content))
+    return items
+
+
+async def load_json_many(paths: Iterable[Path]) -> list[Any]:
+    """
+    Load several JSON files, in order, with None for any that don't exist.
+    
+    Paths are split into at most LIST_READ_CONCURRENCY batches and each batch is
+    read in a single worker-thread hop, so a large directory costs a handful of
+    thread pool round trips instead of one per file.
+    """
+    paths = list(paths)
+    if not paths:
+        return []
+    batch_size = -(-len(paths) // LIST_READ_CONCURRENCY)
+    batches = await asyncio.gather(*(
+        asyncio.to_thread(_read_json_batch, paths[i:i + batch_size])
+        for i in range(0, len(paths), batch_size)
+    ))
+    return [data for batch in batches for data in batch]
 
 
 async def list_json_files(directory: Path) -> list[dict]:
@@ -32,44 +132,73 @@ async def list_json_files(directory: Path) -> list[dict]:
     if not directory.exists():
         return []
     
-    items = []
-    for file_path in directory.glob("*.json"):
-        data = await load_json(file_path)
-        if data:
-            items.append(data)
-    return items
+    results = await load_json_many(directory.glob("*.json"))
+    return [data for data in results if data]
 
 
 def generate_id() -> str:
-    """Generate a unique ID."""
-    return str(uuid.uuid4())
+    """Generate a unique ID (128 random bits as 32 hex chars)."""
+    return secrets.token_hex(16)
 
 
-async def save_image(image_data: bytes, chat_session_id: str, filename: str = None) -> str:
-    """Save an image to the session's image folder."""
+# Media directories already created by this process
+_mkdir_cache: set[Path] = set()
+
+
+async def _ensure_dir(path: Path) -> None:
+    """Create a directory once; later calls for the same path skip the mkdir syscall."""
+    if path not in _mkdir_cache:
+        await asyncio.to_thread(path.mkdir, parents=True, exist_ok=True)
+        _mkdir_cache.add(path)
+
+
+async def _media_path(subdir: str, ext: str, chat_session_id: str, filename: str = None) -> tuple[Path, str]:
+    """Resolve (file path, static URL) for a session media file, creating its folder."""
     if filename is None:
-        filename = f"{generate_id()}.png"
+        filename = f"{generate_id()}.{ext}"
     
-    session_dir = settings.data_dir / "images" / f"chat_session_{chat_session_id}"
-    session_dir.mkdir(parents=True, exist_ok=True)
+    session_folder = f"chat_session_{chat_session_id}"
+    session_dir = settings.data_dir / subdir / session_folder
+    await _ensure_dir(session_dir)
     
-    image_path = session_dir / filename
-    async with aiofiles.open(image_path, 'wb') as f:
-        await f.write(image_data)
+    return session_dir / filename, f"/static/{subdir}/{session_folder}/{filename}"
+
+
+async def _save_media(subdir: str, ext: str, data: bytes, chat_session_id: str, filename: str = None) -> str:
+    """Write a session media file and return its static URL."""
+    path, url = await _media_path(subdir, ext, chat_session_id, filename)
+    await asyncio.to_thread(path.write_bytes, data)
+    return url
+
+
+async def save_image(image_data: bytes, chat_session_id: str, filename: str = None) -> str:
+    """Save an image to the session's image folder."""
+    return await _save_media("images", "png", image_data, chat_session_id, filename)
+
+
+async def save_image_stream(
+    chunks: Union[AsyncIterable[bytes], Iterable[bytes]],
+    chat_session_id: str,
+    filename: str = None
+) -> str:
+    """Save an image to the session's image folder, writing chunks as they arrive."""
+    image_path, url = await _media_path("images", "png", chat_session_id, filename)
+    try:
+        async with aiofiles.open(image_path, 'wb') as f:
+            if hasattr(chunks, "__aiter__"):
+                async for chunk in chunks:
+                    await f.write(chunk)
+            else:
+                for chunk in chunks:
+                    await f.write(chunk)
+    except BaseException:
+        # Don't leave a truncated image behind
+        image_path.unlink(missing_ok=True)
+        raise
     
-    return f"/static/images/chat_session_{chat_session_id}/{filename}"
+    return url
 
 
 async def save_audio(audio_data: bytes, chat_session_id: str, filename: str = None) -> str:
     """Save an audio file to the session's audio folder."""
-    if filename is None:
-        filename = f"{generate_id()}.mp3"
-    
-    session_dir = settings.data_dir / "audio" / f"chat_session_{chat_session_id}"
-    session_dir.mkdir(parents=True, exist_ok=True)
-    
-    audio_path = session_dir / filename
-    async with aiofiles.open(audio_path, 'wb') as f:
-        await f.write(audio_data)
-    
-    return f"/static/audio/chat_session_{chat_session_id}/{filename}"
+    return await _save_media("audio", "mp3", audio_data, chat_session_id, filename)
@@ -0,0 +1,30 @@
+"""
+Shared HTTP client for outbound API calls (LLM, TTS, image generation).
+
+One pooled client lets consecutive requests to the same provider reuse warm
+keepalive/TLS connections instead of handshaking on every call.
+"""
+import httpx
+from typing import Optional
+
+
+HTTP_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=10.0)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return _client
+
+
+async def close_http_client():
+    """Close the shared HTTP client (called on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -3,13 +3,16 @@ Structured logging configuration for DeepRP.
 
 Provides consistent logging across all modules with:
 - Console output (INFO level)
-- File logging (DEBUG level)
+- File logging (DEBUG level), written by a background thread
 - Structured format for easy parsing
 """
+import atexit
 import logging
+import queue
 import sys
+import threading
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
 
 from config import settings
 
@@ -20,7 +23,9 @@ def setup_logging(
     console_level: int = logging.INFO,
     file_level: int = logging.DEBUG,
     max_bytes: int = 10 * 1024 * 1024,  # 10MB
-    backup_count: int = 5
+    backup_count: int = 5,
+    buffer_capacity: int = 512,
+    flush_interval: float = 5.0
 ) -> logging.Logger:
     """
     Set up structured logging with console and file handlers.
@@ -32,6 +37,8 @@ def setup_logging(
         file_level: Minimum level for file output
         max_bytes: Maximum log file size before rotation
         backup_count: Number of backup files to keep
+        buffer_capacity: File records buffered before a write (errors flush at once)
+        flush_interval: Seconds between writes of a partly filled buffer
     
     Returns:
         Configured logger instance
@@ -62,7 +69,8 @@ def setup_logging(
             log_path,
             maxBytes=max_bytes,
             backupCount=backup_count,
-            encoding='utf-8'
+            encoding='utf-8',
+            delay=True  # Open on the first record, not at import
         )
         file_handler.setLevel(file_level)
         file_format = logging.Formatter(
@@ -70,7 +78,40 @@ def setup_logging(
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         file_handler.setFormatter(file_format)
-        logger.addHandler(file_handler)
+        
+        # Hand records to the file in batches; ERROR and above flush immediately
+        buffered_handler = MemoryHandler(
+            buffer_capacity,
+            flushLevel=logging.ERROR,
+            target=file_handler,
+            flushOnClose=True
+        )
+        buffered_handler.setLevel(file_level)
+        
+        # Log calls only enqueue the record; the listener thread does the disk writes
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, buffered_handler, respect_handler_level=True)
+        listener.start()
+        
+        # Write out a partly filled buffer regularly so quiet periods don't hold records back
+        stop_flushing = threading.Event()
+        
+        def flush_periodically():
+            while not stop_flushing.wait(flush_interval):
+                buffered_handler.flush()
+        
+        threading.Thread(target=flush_periodically, name="deeprp-log-flush", daemon=True).start()
+        
+        def stop_file_logging():
+            stop_flushing.set()
+            listener.stop()
+            buffered_handler.close()
+        
+        atexit.register(stop_file_logging)
+        
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.setLevel(file_level)
+        logger.addHandler(queue_handler)
     except Exception as e:
         # Log to console if file logging fails, but don't crash
         console_handler.setLevel(logging.DEBUG)